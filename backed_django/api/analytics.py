@@ -0,0 +1,319 @@
+"""Streaming attention analytics of the active sessions.
+
+Every score produced for a session (see ``api.realtime``) updates the
+session's ``SessionTracker`` in O(1) time and memory. The tracker keeps,
+for the whole session and for each Pomodoro phase:
+- an EWMA of the score and its running mean and variance (Welford);
+- the seconds spent at each attention level;
+- the distraction episodes.
+Alerts and reports read the resulting ``SessionSummary`` rows instead of
+the raw frames.
+
+The batches of a session may be scored by any worker process, so the
+tracker is not kept in memory: its state is stored with the session's
+``SessionSummary`` and every score is added under the row's write lock.
+The summary is partial until the session closes, which ends its last
+distraction episode.
+"""
+import math
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .inference import LABEL_DISTRACTION
+from .models import SessionSummary
+from .rollups import LEVELS
+
+# The phases of the StudentDashboard Pomodoro timer
+PHASE_WORK = 'trabajo'
+PHASES = (PHASE_WORK, 'descanso-corto', 'descanso-largo')
+# Scores received before the client reported any phase
+NO_PHASE = 'none'
+# Distraction episodes kept in a summary
+HISTORY = 50
+
+
+class RunningStats:
+    """Score statistics of one phase, or of a whole session."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.ewma = None
+        self.seconds = dict.fromkeys(LEVELS, 0.0)
+        self.episodes = 0
+        self.distracted_seconds = 0.0
+        self.longest_episode = 0.0
+
+    def add(self, score, alpha):
+        self.count += 1
+        delta = score - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (score - self.mean)
+        self.min = score if self.min is None else min(self.min, score)
+        self.max = score if self.max is None else max(self.max, score)
+        self.ewma = score if self.ewma is None else self.ewma + alpha * (score - self.ewma)
+
+    def add_episode(self, seconds):
+        self.episodes += 1
+        self.distracted_seconds += seconds
+        self.longest_episode = max(self.longest_episode, seconds)
+
+    def merge(self, other):
+        """Add the statistics of ``other`` (Chan et al.'s pairwise update)."""
+        count = self.count + other.count
+        if other.count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self.ewma = other.ewma
+        self.count = count
+        for level in LEVELS:
+            self.seconds[level] += other.seconds[level]
+        self.episodes += other.episodes
+        self.distracted_seconds += other.distracted_seconds
+        self.longest_episode = max(self.longest_episode, other.longest_episode)
+        return self
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else None
+
+    def as_dict(self):
+        def rounded(value, digits=1):
+            return None if value is None else round(value, digits)
+        return {
+            'samples': self.count,
+            'mean': rounded(self.mean if self.count else None, 2),
+            'std': rounded(self.std, 2),
+            'min': self.min,
+            'max': self.max,
+            'ewma': rounded(self.ewma, 2),
+            'seconds': {level: round(s, 1) for level, s in self.seconds.items()},
+            'episodes': self.episodes,
+            'distracted_seconds': round(self.distracted_seconds, 1),
+            'longest_episode': round(self.longest_episode, 1),
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Inverse of ``vars(stats)``, unlike ``from_dict`` without rounding."""
+        stats = cls()
+        stats.__dict__.update(state)
+        stats.seconds = dict(state['seconds'])
+        return stats
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.count = data['samples']
+        stats.mean = data['mean'] or 0.0
+        stats.m2 = (data['std'] or 0.0) ** 2 * stats.count
+        stats.min, stats.max, stats.ewma = data['min'], data['max'], data['ewma']
+        stats.seconds.update(data['seconds'])
+        stats.episodes = data['episodes']
+        stats.distracted_seconds = data['distracted_seconds']
+        stats.longest_episode = data['longest_episode']
+        return stats
+
+
+class SessionTracker:
+    """Running analytics of the scores of one session.
+
+    Timestamps are milliseconds since the epoch. The interval between two
+    scores is counted at the level and phase of the earlier one. Intervals
+    longer than ``max_gap`` seconds (camera off) are not counted, and they
+    end any distraction episode and restart the EWMA. An episode runs from
+    the first distracted score to the next attentive one. Episodes shorter
+    than ``min_episode`` seconds are ignored.
+    """
+
+    def __init__(self, ewma_seconds=30, max_gap=10, min_episode=3, alert_seconds=30, history=50):
+        self.ewma_seconds = ewma_seconds
+        self.max_gap = max_gap
+        self.min_episode = min_episode
+        self.alert_seconds = alert_seconds
+        self.total = RunningStats()
+        self.phases = {}
+        self.phase = NO_PHASE
+        self.first_ts = None
+        self.last_ts = None
+        self.last_level = None
+        self.episode_start = None
+        self.alerted = False
+        # The latest episodes, for the summary
+        self.episodes = deque(maxlen=history)
+
+    def _stats(self):
+        stats = self.phases.get(self.phase)
+        if stats is None:
+            stats = self.phases[self.phase] = RunningStats()
+        return stats
+
+    def observe(self, ts, score, level, distracted, phase=None):
+        """Add one score; returns the alert events it raises."""
+        if self.last_ts is not None and ts <= self.last_ts:
+            return []
+        dt = 0.0 if self.last_ts is None else (ts - self.last_ts) / 1000
+        if dt > self.max_gap:
+            self._end_episode(self.last_ts)
+            dt = 0.0
+        elif dt:
+            self.total.seconds[self.last_level] += dt
+            self._stats().seconds[self.last_level] += dt
+        if phase and phase != self.phase:
+            self._end_episode(ts)
+            self.phase = phase
+
+        alpha = 1.0 - math.exp(-dt / self.ewma_seconds) if dt else 1.0
+        self.total.add(score, alpha)
+        self._stats().add(score, alpha)
+        self.first_ts = ts if self.first_ts is None else self.first_ts
+        self.last_ts, self.last_level = ts, level
+
+        events = []
+        if not distracted:
+            self._end_episode(ts)
+        elif self.episode_start is None:
+            self.episode_start = ts
+        elif not self.alerted and self.phase == PHASE_WORK and (ts - self.episode_start) / 1000 >= self.alert_seconds:
+            # Distraction during a break is expected; only work phases alert.
+            self.alerted = True
+            events.append({'type': 'distraction_episode', 'since': self.episode_start,
+                           'seconds': round((ts - self.episode_start) / 1000, 1)})
+        return events
+
+    def _end_episode(self, ts):
+        if self.episode_start is None:
+            return
+        seconds = (ts - self.episode_start) / 1000
+        if seconds >= self.min_episode:
+            self.total.add_episode(seconds)
+            self._stats().add_episode(seconds)
+            self.episodes.append({'start': self.episode_start, 'end': ts, 'seconds': round(seconds, 1),
+                                  'phase': self.phase})
+        self.episode_start = None
+        self.alerted = False
+
+    def finish(self):
+        """End the open distraction episode, if any, at the last score."""
+        self._end_episode(self.last_ts)
+
+    def state(self):
+        """The state of the tracker as JSON data, without its episodes."""
+        return {
+            'total': vars(self.total),
+            'phases': {phase: vars(stats) for phase, stats in self.phases.items()},
+            'phase': self.phase,
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'last_level': self.last_level,
+            'episode_start': self.episode_start,
+            'alerted': self.alerted,
+        }
+
+    def load(self, state, episodes=()):
+        """Restore a ``state()`` and the latest ``episodes``."""
+        self.total = RunningStats.from_state(state['total'])
+        self.phases = {phase: RunningStats.from_state(stats) for phase, stats in state['phases'].items()}
+        self.phase, self.first_ts, self.last_ts = state['phase'], state['first_ts'], state['last_ts']
+        self.last_level, self.episode_start, self.alerted = state['last_level'], state['episode_start'], state['alerted']
+        self.episodes.extend(episodes)
+
+    def summary(self):
+        return {
+            **self.total.as_dict(),
+            'first_ts': self.first_ts,
+            'last_ts': self.last_ts,
+            'phase': self.phase,
+            'distracted_since': self.episode_start,
+            'phases': {phase: stats.as_dict() for phase, stats in self.phases.items()},
+            'recent_episodes': list(self.episodes),
+        }
+
+
+def _new_tracker(state=None, episodes=()):
+    tracker = SessionTracker(
+        ewma_seconds=getattr(settings, 'ANALYTICS_EWMA_SECONDS', 30),
+        max_gap=getattr(settings, 'ANALYTICS_MAX_GAP_SECONDS', 10),
+        min_episode=getattr(settings, 'ANALYTICS_MIN_EPISODE_SECONDS', 3),
+        alert_seconds=getattr(settings, 'ANALYTICS_ALERT_SECONDS', 30),
+        history=HISTORY,
+    )
+    if state:
+        tracker.load(state, episodes)
+    return tracker
+
+
+def _summary_fields(data):
+    """``SessionSummary`` fields of a ``SessionTracker.summary()``."""
+    return {
+        'samples': data['samples'],
+        'mean_score': data['mean'],
+        'std_score': data['std'],
+        'seconds': round(sum(data['seconds'].values()), 1),
+        'distraction_episodes': data['episodes'],
+        'distracted_seconds': data['distracted_seconds'],
+        'phases': data['phases'],
+        'episodes': data['recent_episodes'],
+    }
+
+
+def _update(session_id, change):
+    """Apply ``change(tracker)`` to the stored tracker of a session; returns its result and the row."""
+    with transaction.atomic():
+        # Take the write lock before reading the row: SQLite cannot wait to
+        # upgrade a read transaction. Elsewhere this locks the row.
+        if SessionSummary.objects.filter(session_id=session_id).update(samples=F('samples')):
+            summary = SessionSummary.objects.get(session_id=session_id)
+        else:
+            summary = SessionSummary(session_id=session_id)
+        tracker = _new_tracker(summary.state, summary.episodes)
+        result = change(tracker)
+        for name, value in _summary_fields(tracker.summary()).items():
+            setattr(summary, name, value)
+        summary.state = tracker.state()
+        summary.save()
+    return result, summary
+
+
+def observe(session, result, ts, phase=None):
+    """Add an engine result of ``session`` scored at ``ts`` (ms); returns its alert events."""
+    events, _ = _update(session.pk, lambda tracker: tracker.observe(
+        ts, result['score'], result['level'], result['label'] == LABEL_DISTRACTION, phase))
+    return events
+
+
+def live_fields(summary):
+    """The current ``phase``, ``ewma`` score and start of the ongoing episode (``distracted_since``)."""
+    state = summary.state or {}
+    ewma = (state.get('total') or {}).get('ewma')
+    return {'phase': state.get('phase', NO_PHASE), 'ewma': None if ewma is None else round(ewma, 2),
+            'distracted_since': state.get('episode_start')}
+
+
+def close_session(session):
+    """End the last distraction episode of a closed session; returns its summary, None without scores."""
+    if not SessionSummary.objects.filter(session_id=session.pk).exists():
+        return None
+    _, summary = _update(session.pk, lambda tracker: tracker.finish())
+    return summary
+
+
+def phase_report(summaries):
+    """Statistics by Pomodoro phase over several ``SessionSummary`` rows."""
+    totals = {}
+    for summary in summaries:
+        for phase, data in summary.phases.items():
+            totals.setdefault(phase, RunningStats()).merge(RunningStats.from_dict(data))
+    return [
+        {'phase': phase, **totals[phase].as_dict()}
+        for phase in (*PHASES, NO_PHASE) if phase in totals
+    ]
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+class EmailBackend(ModelBackend):
+    """Authenticate with ``email`` and ``password``.
+
+    The user is resolved with a single lookup on the indexed email column
+    and the password is hashed exactly once, also when no user matches, so
+    a failed login costs the same as a successful one. Calls without
+    ``email`` (e.g. the admin login) are left to ``ModelBackend``.
+    """
+
+    def authenticate(self, request, email=None, password=None, **kwargs):
+        if email is None or password is None:
+            return None
+        User = get_user_model()
+        user = User._default_manager.filter(email=email).order_by('pk').first()
+        if user is None:
+            # Run the hasher once anyway to keep timing uniform.
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
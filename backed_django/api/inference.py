@@ -0,0 +1,409 @@
+"""Server-side attention inference with the LSTM described in the README.
+
+Each active session keeps a sliding window of its last frames. A window
+is rebuilt from the sample store when the session's frames were not all
+seen by this process, so batches spread over several workers are never
+scored as one gapped sequence (see ``api.realtime``). Windows of
+many concurrent sessions are grouped by ``InferenceEngine`` into a single
+batched forward pass, bounded by a maximum batch size and a maximum wait.
+
+The forward pass runs on ``NumpyLSTM``, so CPU-only nodes only need the
+exported weights: a version published to ``ATTENTION_MODEL_DIR`` (see
+``api.modelstore``), or else the ``.npz`` file at ``ATTENTION_MODEL_PATH``.
+TensorFlow is used only when it is installed and a Keras model file is
+configured instead.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import tensorflow as tf  # type: ignore
+except Exception:
+    tf = None
+
+LABEL_ATTENTION = 'attention'
+LABEL_DISTRACTION = 'distraction'
+
+
+def attention_level(score):
+    """Map a 0-100 score to the dashboard's high/medium/low levels."""
+    if score < 40:
+        return 'low'
+    if score < 70:
+        return 'medium'
+    return 'high'
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class NumpyLSTM:
+    """Single-layer LSTM followed by a sigmoid unit, in plain NumPy.
+
+    Weights follow the Keras layout (gate order i, f, c, o): ``kernel``
+    (F, 4H), ``recurrent_kernel`` (H, 4H), ``bias`` (4H,), ``dense_kernel``
+    (H, 1) and ``dense_bias`` (1,). Optional ``mean`` and ``std`` (F,)
+    normalize the input features.
+    """
+    ARRAYS = ('kernel', 'recurrent_kernel', 'bias', 'dense_kernel', 'dense_bias', 'mean', 'std')
+
+    def __init__(self, kernel, recurrent_kernel, bias, dense_kernel, dense_bias, mean=None, std=None):
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.recurrent_kernel = np.asarray(recurrent_kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.dense_kernel = np.asarray(dense_kernel, dtype=np.float32)
+        self.dense_bias = np.asarray(dense_bias, dtype=np.float32)
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.std = None if std is None else np.asarray(std, dtype=np.float32)
+        self.units = self.recurrent_kernel.shape[0]
+        self.feature_count = self.kernel.shape[0]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{k: data[k] for k in data.files})
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.ARRAYS if getattr(self, name) is not None}
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    def forward(self, x):
+        """Return the attention probability for each window of ``x`` (B, T, F)."""
+        x = np.asarray(x, dtype=np.float32)
+        if self.mean is not None:
+            x = (x - self.mean) / self.std
+        batch, steps, _ = x.shape
+        H = self.units
+        # Project every time step at once; only the recurrence is sequential.
+        xw = x @ self.kernel + self.bias
+        h = np.zeros((batch, H), dtype=np.float32)
+        c = np.zeros((batch, H), dtype=np.float32)
+        for t in range(steps):
+            z = xw[:, t] + h @ self.recurrent_kernel
+            i = _sigmoid(z[:, :H])
+            f = _sigmoid(z[:, H:2 * H])
+            g = np.tanh(z[:, 2 * H:3 * H])
+            o = _sigmoid(z[:, 3 * H:])
+            c = f * c + i * g
+            h = o * np.tanh(c)
+        return _sigmoid(h @ self.dense_kernel + self.dense_bias)[:, 0]
+
+
+class KerasModel:
+    """Adapter giving a Keras model the same ``forward`` as ``NumpyLSTM``."""
+
+    def __init__(self, model):
+        self.model = model
+        self.feature_count = model.input_shape[-1]
+
+    def forward(self, x):
+        return np.asarray(self.model(np.asarray(x, dtype=np.float32), training=False)).reshape(-1)
+
+
+def from_keras(model):
+    """``NumpyLSTM`` with the weights of a Sequential([LSTM, Dense(1)]) Keras model."""
+    lstm, dense = [layer for layer in model.layers if layer.get_weights()][:2]
+    kernel, recurrent_kernel, bias = lstm.get_weights()
+    dense_kernel, dense_bias = dense.get_weights()
+    return NumpyLSTM(kernel, recurrent_kernel, bias, dense_kernel, dense_bias)
+
+
+def export_keras_weights(model, path):
+    """Write the weights of a Sequential([LSTM, Dense(1)]) Keras model to ``.npz``."""
+    from_keras(model).save(path)
+
+
+def load_model(path):
+    """Load ``.npz`` weights with NumPy, anything else with Keras."""
+    path = str(path)
+    if path.endswith('.npz'):
+        return NumpyLSTM.load(path)
+    if tf is None:
+        raise RuntimeError('TensorFlow is required to load %s; export it to .npz instead' % path)
+    return KerasModel(tf.keras.models.load_model(path))
+
+
+class _Window:
+    """Fixed-size ring buffer with the latest frames of one session."""
+
+    def __init__(self, size, feature_count):
+        self.buf = np.zeros((size, feature_count), dtype=np.float32)
+        self.count = 0
+        # Frame count of the session at the end of the window, when known
+        self.position = None
+        self.touched = time.monotonic()
+
+    def extend(self, frames):
+        size = len(self.buf)
+        frames = frames[-size:]
+        n = len(frames)
+        pos = self.count % size
+        first = min(n, size - pos)
+        self.buf[pos:pos + first] = frames[:first]
+        self.buf[:n - first] = frames[first:]
+        self.count += n
+        self.touched = time.monotonic()
+
+    @property
+    def full(self):
+        return self.count >= len(self.buf)
+
+    def snapshot(self):
+        """Return the window in chronological order."""
+        pos = self.count % len(self.buf)
+        return np.concatenate((self.buf[pos:], self.buf[:pos]))
+
+
+class InferenceEngine:
+    """Per-session sliding windows plus a cross-session micro-batching worker.
+
+    ``submit`` queues the current window of a session and returns a
+    ``Future``. A background thread waits until ``max_batch_size`` windows
+    are pending or the oldest one has waited ``max_wait_ms``, then runs one
+    forward pass for all of them. A session that is already queued is not
+    queued twice; its pending window is refreshed instead.
+    """
+
+    def __init__(self, model, window=30, max_batch_size=64, max_wait_ms=10, threshold=0.5, idle_ttl=300):
+        self.model = model
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.threshold = threshold
+        self.idle_ttl = idle_ttl
+        self._windows = {}
+        self._latest = {}
+        self._pending = {}
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._pid = None
+        self._last_sweep = time.monotonic()
+
+    def observe(self, session_id, frames, position=None):
+        """Append frames (N, F) to a session's window; True once it is full.
+
+        ``position`` is the session's frame count after ``frames``. If the
+        window does not end right before them, the frames are not appended
+        and None is returned. That happens when earlier batches went to
+        another process, or this one never saw the session. The caller must
+        then ``seed`` the window from the stored frames.
+        """
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1, self.model.feature_count)
+        with self._cond:
+            win = self._windows.get(session_id)
+            if position is not None and (win is None or win.position != position - len(frames)):
+                return None
+            if win is None:
+                win = self._windows[session_id] = _Window(self.window, self.model.feature_count)
+            win.extend(frames)
+            win.position = position
+            self._sweep()
+            return win.full
+
+    def seed(self, session_id, frames, position):
+        """Replace a session's window with its latest stored ``frames``, ending at ``position``."""
+        frames = np.asarray(frames, dtype=np.float32).reshape(-1, self.model.feature_count)
+        with self._cond:
+            win = self._windows[session_id] = _Window(self.window, self.model.feature_count)
+            win.extend(frames)
+            win.position = position
+            self._sweep()
+            return win.full
+
+    def position(self, session_id):
+        win = self._windows.get(session_id)
+        return None if win is None else win.position
+
+    def submit(self, session_id):
+        """Queue a session's window for inference; None until the window fills."""
+        with self._cond:
+            win = self._windows.get(session_id)
+            if win is None or not win.full:
+                return None
+            self._ensure_worker()
+            if session_id in self._pending:
+                future = self._pending[session_id][1]
+            else:
+                future = Future()
+                if not self._pending:
+                    self._oldest = time.monotonic()
+            self._pending[session_id] = (win.snapshot(), future)
+            self._cond.notify()
+            return future
+
+    def predict(self, session_id, frames, timeout=1.0):
+        """Observe frames and wait for the session's result, if any."""
+        self.observe(session_id, frames)
+        future = self.submit(session_id)
+        if future is None:
+            return None
+        return future.result(timeout)
+
+    def latest(self, session_id):
+        return self._latest.get(session_id)
+
+    def swap_model(self, model):
+        """Serve ``model`` from the next batch on."""
+        with self._cond:
+            if model.feature_count != self.model.feature_count:
+                self._windows.clear()
+                self._latest.clear()
+            self.model = model
+
+    def close_session(self, session_id):
+        with self._cond:
+            self._windows.pop(session_id, None)
+            self._latest.pop(session_id, None)
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self.idle_ttl:
+            return
+        self._last_sweep = now
+        for session_id in [s for s, w in self._windows.items() if now - w.touched > self.idle_ttl]:
+            self._windows.pop(session_id)
+            self._latest.pop(session_id, None)
+
+    def _ensure_worker(self):
+        # Started lazily so every forked gunicorn worker gets its own thread.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = {}
+            threading.Thread(target=self._run, name='attention-inference', daemon=True).start()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._oldest + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            keys = list(self._pending)[:self.max_batch_size]
+            batch = [(key, *self._pending.pop(key)) for key in keys]
+            self._oldest = time.monotonic() if self._pending else None
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                probs = self.model.forward(np.stack([window for _, window, _ in batch]))
+            except Exception as exc:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            for (session_id, _, future), prob in zip(batch, probs):
+                result = self._result(float(prob))
+                if session_id in self._windows:
+                    self._latest[session_id] = result
+                if not future.done():
+                    future.set_result(result)
+
+    def _result(self, prob):
+        score = round(prob * 100, 1)
+        return {
+            'score': score,
+            'label': LABEL_ATTENTION if prob >= self.threshold else LABEL_DISTRACTION,
+            'level': attention_level(score),
+        }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_registry = None
+# (version, seconds) of the last model load, for the metrics endpoint
+_loaded = (None, None)
+
+
+def get_registry():
+    """Return the registry of ``ATTENTION_MODEL_DIR``, or None if not configured."""
+    global _registry
+    root = getattr(settings, 'ATTENTION_MODEL_DIR', None)
+    if not root:
+        return None
+    if _registry is None or _registry.root != str(root):
+        from .modelstore import ModelRegistry
+
+        _registry = ModelRegistry(
+            root,
+            window=getattr(settings, 'ATTENTION_WINDOW', 30),
+            check_interval=getattr(settings, 'ATTENTION_MODEL_CHECK_INTERVAL', 5),
+        )
+    return _registry
+
+
+def _load_fallback():
+    path = getattr(settings, 'ATTENTION_MODEL_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    start = time.perf_counter()
+    model = load_model(path)
+    model.forward(np.zeros((1, getattr(settings, 'ATTENTION_WINDOW', 30), model.feature_count), dtype=np.float32))
+    return model, (os.path.basename(str(path)), time.perf_counter() - start)
+
+
+def get_engine():
+    """Return the process-wide engine, or None when no model is configured.
+
+    A version newly activated in ``ATTENTION_MODEL_DIR`` replaces the
+    engine's model in place.
+    """
+    global _engine, _loaded
+    registry = get_registry()
+    if registry is not None and registry.refresh() and _engine is not None:
+        _engine.swap_model(registry.model)
+        _loaded = (registry.version, registry.load_seconds)
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if registry is not None and registry.model is not None:
+                    model, loaded = registry.model, (registry.version, registry.load_seconds)
+                else:
+                    fallback = _load_fallback()
+                    if fallback is None:
+                        return None
+                    model, loaded = fallback
+                _engine = InferenceEngine(
+                    model,
+                    window=getattr(settings, 'ATTENTION_WINDOW', 30),
+                    max_batch_size=getattr(settings, 'ATTENTION_MAX_BATCH_SIZE', 64),
+                    max_wait_ms=getattr(settings, 'ATTENTION_MAX_WAIT_MS', 10),
+                    threshold=getattr(settings, 'ATTENTION_DISTRACTION_THRESHOLD', 0.5),
+                )
+                _loaded = loaded
+    return _engine
+
+
+def preload():
+    """Load the model ahead of the first request, e.g. before workers fork."""
+    try:
+        get_engine()
+    except Exception:
+        logging.getLogger(__name__).exception('Cannot preload the attention model')
+
+
+def model_gauges():
+    """Gauges of the loaded model for ``api.metrics``."""
+    from .modelstore import mapped_bytes
+
+    version, seconds = _loaded
+    if _engine is None or version is None:
+        return []
+    labels = (str(os.getpid()), version)
+    return [
+        ('attention_model_load_seconds', labels, seconds),
+        ('attention_model_mapped_bytes', labels, mapped_bytes(_engine.model)),
+    ]
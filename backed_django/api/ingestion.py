@@ -0,0 +1,155 @@
+"""Batched ingestion of the per-frame features extracted by the dashboard.
+
+Frames arrive in batches, either as JSON or as a binary ``FrameBatch``
+(see ``api.wire``), and are stored as packed ``SampleChunk`` rows (see
+``api.models``) in the partitioned sample store (see ``api.samplestore``),
+with one ``bulk_create`` per partition instead of one ORM row per frame.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from . import samplestore
+from .models import AttentionSession, SamplePartition
+from .wire import FrameBatch
+
+MAX_BATCH_FRAMES = getattr(settings, 'ATTENTION_MAX_BATCH_FRAMES', 2000)
+CHUNK_FRAMES = getattr(settings, 'ATTENTION_CHUNK_FRAMES', 256)
+MAX_FEATURE_COUNT = 64
+# Stores of a batch that raced with other batches of its session
+MAX_ATTEMPTS = 3
+
+TIMESTAMP_DTYPE = np.dtype('<f8')
+FEATURE_DTYPE = np.dtype('<f4')
+
+
+class SessionClosed(Exception):
+    """Raised when frames are posted to a session that already ended."""
+
+
+def chunk_arrays(chunk, feature_count):
+    """Return the ``(timestamps, features)`` arrays stored in a ``SampleChunk``."""
+    ts = np.frombuffer(bytes(chunk.timestamps), dtype=TIMESTAMP_DTYPE)
+    feats = np.frombuffer(bytes(chunk.features), dtype=FEATURE_DTYPE).reshape(-1, feature_count)
+    return ts, feats
+
+
+def chunk_frames(chunk, feature_count):
+    """Yield ``(timestamp, features)`` pairs stored in a ``SampleChunk``."""
+    yield from zip(*chunk_arrays(chunk, feature_count))
+
+
+def frames_from_json(frames, feature_count):
+    """Convert JSON frames to ``(timestamps, features)`` arrays.
+
+    Each frame is a mapping with a ``t`` timestamp (ms since the epoch) and
+    a ``features`` list of ``feature_count`` numbers; other frames are left
+    out.
+    """
+    timestamps = []
+    rows = []
+    for frame in frames:
+        try:
+            t = float(frame['t'])
+            values = [float(v) for v in frame['features']]
+        except (TypeError, KeyError, ValueError):
+            continue
+        if len(values) == feature_count:
+            timestamps.append(t)
+            rows.append(values)
+    return np.array(timestamps, dtype=np.float64), np.array(rows, dtype=np.float32).reshape(-1, feature_count)
+
+
+def clean_frames(frames, feature_count, last_ts=None):
+    """Validate a batch of JSON frames or a ``FrameBatch``.
+
+    Frames that are malformed, non-finite or not strictly after the
+    previous accepted timestamp are dropped, as are frames beyond
+    ``MAX_BATCH_FRAMES``. Returns ``(timestamps, features, dropped)``.
+    """
+    total = len(frames)
+    if not isinstance(frames, FrameBatch):
+        timestamps, features = frames_from_json(frames[:MAX_BATCH_FRAMES], feature_count)
+    elif frames.feature_count == feature_count:
+        timestamps, features = frames.timestamps[:MAX_BATCH_FRAMES], frames.features[:MAX_BATCH_FRAMES]
+    else:
+        return np.empty(0), np.empty((0, feature_count), dtype=np.float32), total
+
+    valid = np.isfinite(timestamps) & np.isfinite(features).all(axis=1)
+    # A frame is accepted when it is later than every earlier valid frame.
+    start = -np.inf if last_ts is None else last_ts
+    previous = np.maximum.accumulate(np.concatenate(([start], np.where(valid, timestamps, -np.inf))))[:-1]
+    keep = valid & (timestamps > previous)
+    return timestamps[keep], features[keep], total - int(keep.sum())
+
+
+class _Conflict(DatabaseError):
+    """Another batch of the session was stored first."""
+
+    def __init__(self, chunk_count=None):
+        super().__init__('Concurrent batches of one session')
+        # The session's chunk_count when the chunks could not be inserted
+        self.chunk_count = chunk_count
+
+
+def ingest_batch(session_id, frames):
+    """Store a batch of frames for a session.
+
+    Returns a dict with the ``accepted`` and ``dropped`` frame counts and
+    the session's total ``frame_count`` after the write, together with the
+    (N, F) array of accepted features. A batch that races with another
+    batch of the session is cleaned and stored again after it.
+    """
+    course = AttentionSession.objects.values_list('course', flat=True).get(pk=session_id)
+    overwrite = False
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return _store(session_id, course, frames, overwrite)
+        except _Conflict as conflict:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            if conflict.chunk_count is not None:
+                # A concurrent batch updates the counters before its chunks
+                # become visible. With chunk_count unchanged, the chunks in
+                # the way were left by a batch whose counters were lost.
+                overwrite = AttentionSession.objects.filter(pk=session_id, chunk_count=conflict.chunk_count).exists()
+
+
+def _store(session_id, course, frames, overwrite):
+    with transaction.atomic(using=samplestore.database()):
+        # Only the short counter update below writes to the default
+        # database. On SQLite this write makes the transaction take the
+        # samples write lock first, which serializes the batches: SQLite
+        # cannot wait to upgrade a read transaction.
+        SamplePartition.objects.filter(course=course).update(week_end=F('week_end'))
+        session = AttentionSession.objects.get(pk=session_id)
+        if not session.is_open:
+            raise SessionClosed(session_id)
+
+        timestamps, features, dropped = clean_frames(frames, session.feature_count, session.last_ts)
+        accepted = len(timestamps)
+        if not accepted:
+            return {'accepted': 0, 'dropped': dropped, 'frame_count': session.frame_count}, features
+
+        try:
+            with transaction.atomic(using=samplestore.database()):
+                written = samplestore.write_chunks(session, timestamps, features, CHUNK_FRAMES, overwrite)
+        except IntegrityError:
+            raise _Conflict(session.chunk_count)
+        # Only counts the chunks if no other batch was counted meanwhile.
+        updated = AttentionSession.objects.filter(
+            pk=session.pk, chunk_count=session.chunk_count, ended_at__isnull=True,
+        ).update(
+            frame_count=F('frame_count') + accepted,
+            chunk_count=F('chunk_count') + written,
+            first_ts=Coalesce('first_ts', Value(float(timestamps[0]))),
+            last_ts=float(timestamps[-1]),
+        )
+        if not updated:
+            # The chunks are rolled back with the samples transaction.
+            if AttentionSession.objects.filter(pk=session.pk, ended_at__isnull=False).exists():
+                raise SessionClosed(session_id)
+            raise _Conflict()
+    return {'accepted': accepted, 'dropped': dropped, 'frame_count': session.frame_count + accepted}, features
@@ -0,0 +1,304 @@
+import http.client
+import json
+import logging
+import platform
+import re
+import subprocess
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import Resolver404, resolve
+
+from api import wire
+
+QUERY_STAT = re.compile(r'^db_queries_per_request_(sum|count)\{(.*)\} (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_query_stats(text):
+    """``{(route, method): [queries, requests]}`` from the server's ``/api/metrics/`` text."""
+    stats = defaultdict(lambda: [0.0, 0.0])
+    for line in text.splitlines():
+        match = QUERY_STAT.match(line)
+        if not match:
+            continue
+        labels = {name: re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+                  for name, value in LABEL.findall(match.group(2))}
+        stats[labels.get('route'), labels.get('method')][match.group(1) == 'count'] += float(match.group(3))
+    return stats
+
+
+class HttpTarget:
+    """Sends requests to a running server, one keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise CommandError(f'Unsupported URL {url}')
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.netloc, timeout=30)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, response.read(), None
+            except (http.client.HTTPException, ConnectionError):
+                # The server may close idle keep-alive connections; retry once.
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise
+
+    def query_stats(self, token):
+        """Queries per route of the server (``parse_query_stats``), or None without access."""
+        if not token:
+            return None
+        status, content, _ = self.request('GET', '/api/metrics/', headers={'Authorization': f'Token {token}'})
+        return parse_query_stats(content.decode()) if status == 200 else None
+
+    def close(self):
+        pass
+
+
+class InProcessTarget:
+    """Runs requests through the Django test client against a test database.
+
+    Requests are serialized (SQLite test databases do not take concurrent
+    writers), but each one reports its exact number of SQL queries, on the
+    default and the samples databases.
+    """
+
+    def __init__(self):
+        from django.test import Client
+        from django.test.utils import setup_databases, setup_test_environment, teardown_test_environment
+
+        setup_test_environment()
+        # Keep the throwaway requests out of the server's metrics.
+        self._settings = override_settings(METRICS_DIR=None)
+        self._settings.enable()
+        # Expected 503s (no attention model) would otherwise flood the output.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        self._teardown_env = teardown_test_environment
+        self._old_config = setup_databases(verbosity=0, interactive=False)
+        self.client = Client()
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        extra = {'HTTP_' + k.upper().replace('-', '_'): v for k, v in headers.items() if k != 'Content-Type'}
+        with self._lock, ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            response = self.client.generic(
+                method, path, body or b'', content_type=headers.get('Content-Type', 'application/json'), **extra)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, content, sum(len(queries) for queries in captured)
+
+    def close(self):
+        from django.test.utils import teardown_databases
+        teardown_databases(self._old_config, verbosity=0)
+        self._settings.disable()
+        self._teardown_env()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(list)
+        # Route and method of each endpoint, and its queries per request as
+        # reported by the server, for targets that cannot count them
+        self.routes = {}
+        self.server_queries = {}
+        self._lock = threading.Lock()
+
+    def call(self, target, endpoint, method, path, body=None, headers=None, expect=(200, 201)):
+        start = time.perf_counter()
+        try:
+            status, content, queries = target.request(method, path, body, headers)
+        except Exception:
+            status, content, queries = None, b'', None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples[endpoint].append(elapsed)
+            if status not in expect:
+                self.errors[endpoint] += 1
+            if queries is not None:
+                self.queries[endpoint].append(queries)
+            elif endpoint not in self.routes:
+                try:
+                    self.routes[endpoint] = (resolve(urlsplit(path).path).route, method)
+                except Resolver404:
+                    self.routes[endpoint] = None
+        if status in expect and content:
+            return json.loads(content)
+        return None
+
+    def add_server_queries(self, before, after):
+        """Queries per request of each endpoint from two ``parse_query_stats`` results."""
+        for endpoint, key in self.routes.items():
+            if key is None:
+                continue
+            queries, requests = (after.get(key, [0, 0])[i] - before.get(key, [0, 0])[i] for i in (0, 1))
+            if requests:
+                self.server_queries[endpoint] = queries / requests
+
+    def summary(self, wall):
+        endpoints = {}
+        for endpoint, timings in sorted(self.samples.items()):
+            ms = np.array(timings) * 1000
+            queries = self.queries.get(endpoint)
+            endpoints[endpoint] = {
+                'requests': len(ms),
+                'errors': self.errors[endpoint],
+                'throughput_rps': round(len(ms) / wall, 2),
+                'mean_ms': round(float(ms.mean()), 2),
+                'p50_ms': round(float(np.percentile(ms, 50)), 2),
+                'p95_ms': round(float(np.percentile(ms, 95)), 2),
+                'p99_ms': round(float(np.percentile(ms, 99)), 2),
+                'queries_per_request': (round(float(np.mean(queries)), 2) if queries else
+                                        round(self.server_queries[endpoint], 2) if endpoint in self.server_queries
+                                        else None),
+            }
+        return endpoints
+
+
+def simulate_student(target, recorder, index, run_id, options):
+    """Login, start a session, stream batches, poll scores and open the report."""
+    rng = np.random.default_rng(index)
+    email = f'bench-{run_id}-{index}@example.com'
+    password = 'bench-pass-' + run_id
+    features = options['features']
+    json_headers = {'Content-Type': 'application/json'}
+
+    credentials = json.dumps({'email': email, 'password': password, 'fullName': f'Bench {index}'})
+    recorder.call(target, 'POST /api/auth/register/', 'POST', '/api/auth/register/', credentials, json_headers)
+    login = recorder.call(target, 'POST /api/auth/login/', 'POST', '/api/auth/login/', credentials, json_headers)
+    if login is None:
+        return
+    auth = {'Authorization': f'Token {login["token"]}'}
+
+    classroom = f'bench-{run_id}-{index % options["classes"]}'
+    session = recorder.call(target, 'POST /api/sessions/', 'POST', '/api/sessions/',
+                            json.dumps({'feature_count': features, 'classroom': classroom}), {**json_headers, **auth})
+    if session is None:
+        return
+    base = f'/api/sessions/{session["id"]}'
+
+    t = time.time() * 1000
+    batch_frames = options['batch_frames']
+    for batch in range(options['batches']):
+        ts = t + np.arange(batch_frames) * 100.0
+        t = ts[-1] + 100.0
+        values = (0.3 + rng.normal(scale=0.05, size=(batch_frames, features))).astype(np.float32)
+        if options['format'] == 'json':
+            body = json.dumps({'frames': [{'t': float(a), 'features': b.tolist()} for a, b in zip(ts, values)]})
+            headers = {**json_headers, **auth}
+        else:
+            body = wire.encode(ts, values, dtype='f2' if options['format'] == 'f16' else 'f4')
+            headers = {'Content-Type': wire.MEDIA_TYPE, **auth}
+        recorder.call(target, 'POST /api/sessions/{id}/samples/', 'POST', f'{base}/samples/', body, headers)
+        if options['poll_every'] and (batch + 1) % options['poll_every'] == 0:
+            # 503 means no attention model is configured on the server.
+            recorder.call(target, 'GET /api/sessions/{id}/attention/', 'GET', f'{base}/attention/',
+                          headers=auth, expect=(200, 503))
+        if options['interval']:
+            time.sleep(options['interval'])
+
+    recorder.call(target, 'GET /api/reports/students/{id}/', 'GET',
+                  f'/api/reports/students/{login["user"]["id"]}/', headers=auth)
+    recorder.call(target, 'POST /api/sessions/{id}/close/', 'POST', f'{base}/close/', headers=auth)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Simulate concurrent students against the monitoring API and report throughput, '
+            'latency percentiles and SQL queries per endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to load (default: %(default)s).')
+        parser.add_argument('--in-process', action='store_true',
+                            help='Use the Django test client on a throwaway test database and count SQL queries.')
+        parser.add_argument('--students', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=None, help='Worker threads (default: one per student).')
+        parser.add_argument('--classes', type=int, default=4, help='Classrooms the students are spread over.')
+        parser.add_argument('--batches', type=int, default=20, help='Feature batches per student.')
+        parser.add_argument('--batch-frames', type=int, default=10)
+        parser.add_argument('--features', type=int, default=8)
+        parser.add_argument('--format', choices=['json', 'f32', 'f16'], default='f32')
+        parser.add_argument('--poll-every', type=int, default=1, help='Poll the score every N batches (0: never).')
+        parser.add_argument('--interval', type=float, default=0, help='Seconds between batches of a student.')
+        parser.add_argument('--metrics-token', default=None,
+                            help='API token of a staff user, to read SQL queries per request from the '
+                                 "server's /api/metrics/ (other traffic during the run is counted too).")
+        parser.add_argument('--output', default='bench_monitoring.json', help='JSON results file (default: %(default)s).')
+
+    def handle(self, *args, **options):
+        target = InProcessTarget() if options['in_process'] else HttpTarget(options['url'])
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:8]
+        workers = 1 if options['in_process'] else (options['concurrency'] or options['students'])
+        stats = None if options['in_process'] else target.query_stats(options['metrics_token'])
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(simulate_student, target, recorder, i, run_id, options)
+                           for i in range(options['students'])]
+                for future in futures:
+                    future.result()
+        finally:
+            target.close()
+        wall = time.perf_counter() - start
+        if stats is not None:
+            recorder.add_server_queries(stats, target.query_stats(options['metrics_token']) or stats)
+
+        endpoints = recorder.summary(wall)
+        total = sum(e['requests'] for e in endpoints.values())
+        result = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'target': 'in-process' if options['in_process'] else options['url'],
+            'options': {k: options[k] for k in ('students', 'classes', 'batches', 'batch_frames', 'features',
+                                                'format', 'poll_every', 'interval')},
+            'wall_seconds': round(wall, 3),
+            'total_requests': total,
+            'throughput_rps': round(total / wall, 2),
+            'endpoints': endpoints,
+        }
+        with open(options['output'], 'w') as out:
+            json.dump(result, out, indent=2)
+
+        self.stdout.write(f'{total} requests in {wall:.2f}s ({result["throughput_rps"]} req/s)')
+        self.stdout.write(f'{"endpoint":<38} {"reqs":>6} {"err":>4} {"rps":>8} {"p50":>8} {"p95":>8} {"p99":>8} {"queries":>8}')
+        for name, e in endpoints.items():
+            queries = '-' if e['queries_per_request'] is None else f'{e["queries_per_request"]:.1f}'
+            self.stdout.write(f'{name:<38} {e["requests"]:>6} {e["errors"]:>4} {e["throughput_rps"]:>8.1f} '
+                              f'{e["p50_ms"]:>8.1f} {e["p95_ms"]:>8.1f} {e["p99_ms"]:>8.1f} {queries:>8}')
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
@@ -0,0 +1,74 @@
+import gzip
+import io
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+
+from api import wire
+from api.ingestion import frames_from_json
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and parse time of JSON and binary frame batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=1000)
+        parser.add_argument('--features', type=int, default=16)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--json', dest='json_output', help='Also write the results to this file.')
+
+    def handle(self, *args, **options):
+        n, f = options['frames'], options['features']
+        rng = np.random.default_rng(0)
+        timestamps = 1.7e12 + np.arange(n) * 100.0
+        # Slowly varying signals, like eye/mouth aspect ratios
+        features = (0.3 + np.cumsum(rng.normal(scale=0.005, size=(n, f)), axis=0)).astype(np.float32)
+
+        payloads = {'json': json.dumps({'frames': [
+            {'t': float(t), 'features': [float(v) for v in row]} for t, row in zip(timestamps, features)
+        ]}).encode()}
+        for name, dtype, delta in (('f32', 'f4', False), ('f16', 'f2', False), ('f16-delta', 'f2', True)):
+            payloads[name] = wire.encode(timestamps, features, dtype=dtype, delta=delta)
+
+        json_parser, frame_parser = JSONParser(), wire.FrameBatchParser()
+
+        def parse_json():
+            data = json_parser.parse(io.BytesIO(payloads['json']))
+            frames_from_json(data['frames'], f)
+
+        results = []
+        for name, payload in payloads.items():
+            if name == 'json':
+                parse = parse_json
+            else:
+                parse = lambda payload=payload: frame_parser.parse(io.BytesIO(payload))
+            seconds = best_of(options['repeat'], parse)
+            results.append({
+                'format': name,
+                'bytes': len(payload),
+                'gzip_bytes': len(gzip.compress(payload)),
+                'parse_ms': round(seconds * 1000, 3),
+            })
+
+        base = results[0]
+        self.stdout.write(f'{n} frames x {f} features, best of {options["repeat"]}')
+        self.stdout.write(f'{"format":<10} {"bytes":>10} {"gzip":>10} {"parse ms":>10} {"speedup":>8}')
+        for row in results:
+            speedup = base['parse_ms'] / row['parse_ms'] if row['parse_ms'] else float('inf')
+            self.stdout.write(f'{row["format"]:<10} {row["bytes"]:>10} {row["gzip_bytes"]:>10} '
+                              f'{row["parse_ms"]:>10.3f} {speedup:>7.1f}x')
+        if options['json_output']:
+            with open(options['json_output'], 'w') as out:
+                json.dump({'frames': n, 'features': f, 'results': results}, out, indent=2)
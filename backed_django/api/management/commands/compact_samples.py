@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import samplestore
+from api.models import AttentionSession, SampleAggregate, SamplePartition
+
+
+class Command(BaseCommand):
+    help = ('Downsample sample partitions older than SAMPLE_RAW_RETENTION_DAYS into aggregates, drop them, '
+            'and delete aggregates older than SAMPLE_AGGREGATE_RETENTION_DAYS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--raw-days', type=float, default=getattr(settings, 'SAMPLE_RAW_RETENTION_DAYS', 28))
+        parser.add_argument('--aggregate-days', type=float,
+                            default=getattr(settings, 'SAMPLE_AGGREGATE_RETENTION_DAYS', 365))
+        parser.add_argument('--seconds', type=int, default=getattr(settings, 'SAMPLE_AGGREGATE_SECONDS', 60),
+                            help='Aggregate bucket width (must divide a week).')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the partitions that would be dropped.')
+
+    def handle(self, *args, **options):
+        seconds = options['seconds']
+        if seconds <= 0 or samplestore.WEEK_MS % (seconds * 1000):
+            # Buckets start at the partition's week and must not straddle two partitions.
+            raise CommandError('--seconds must divide a week')
+        now = time.time() * 1000
+        expired = SamplePartition.objects.filter(week_end__lte=now - options['raw_days'] * 86400000)
+        expired = list(expired.order_by('week_start'))
+        for partition in expired:
+            if options['dry_run']:
+                self.stdout.write(f'Would drop {partition.table}')
+                continue
+            # Sessions of the partition's course; others cannot have chunks there.
+            sessions = AttentionSession.objects.filter(course=partition.course).values_list('pk', 'feature_count')
+            rows = samplestore.drop_partition(partition, dict(sessions), seconds)
+            self.stdout.write(f'Dropped {partition.table} ({rows} aggregates)')
+
+        if options['aggregate_days'] is not None and not options['dry_run']:
+            deleted, _ = SampleAggregate.objects.filter(
+                start_ts__lt=now - options['aggregate_days'] * 86400000).delete()
+            if deleted:
+                self.stdout.write(f'Deleted {deleted} expired aggregates')
+        self.stdout.write(self.style.SUCCESS(f'{len(expired)} partition(s) past retention'))
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import modelstore
+from api.inference import NumpyLSTM, from_keras, tf
+
+
+class Command(BaseCommand):
+    help = ('Publish attention model weights as a new memory-mapped version in ATTENTION_MODEL_DIR, '
+            'or switch the active version. Running workers pick the change up without a restart.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Weights to publish: an exported .npz or a Keras model file.')
+        parser.add_argument('--name', help='Version name (default: a timestamp).')
+        parser.add_argument('--no-activate', action='store_true', help='Publish without serving it yet.')
+        parser.add_argument('--activate', dest='activate_version', metavar='VERSION',
+                            help='Serve an already published version (also used to roll back).')
+        parser.add_argument('--list', action='store_true', help='List the published versions.')
+
+    def handle(self, *args, **options):
+        root = getattr(settings, 'ATTENTION_MODEL_DIR', None)
+        if not root:
+            raise CommandError('ATTENTION_MODEL_DIR is not set')
+        root = str(root)
+
+        if options['list']:
+            current = modelstore.current_version(root)
+            for version in modelstore.list_versions(root):
+                self.stdout.write(f'{"*" if version == current else " "} {version}')
+            return
+        if options['activate_version']:
+            try:
+                modelstore.activate(root, options['activate_version'])
+            except FileNotFoundError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(self.style.SUCCESS(f'Serving version {options["activate_version"]}'))
+            return
+        if not options['path']:
+            raise CommandError('Give the weights to publish, --activate VERSION or --list')
+
+        path = options['path']
+        try:
+            if path.endswith('.npz'):
+                model = NumpyLSTM.load(path)
+            elif tf is not None:
+                model = from_keras(tf.keras.models.load_model(path))
+            else:
+                raise CommandError('TensorFlow is required to read %s; export it to .npz instead' % path)
+            version = modelstore.publish(root, model, options['name'], make_current=not options['no_activate'])
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            raise CommandError(f'Cannot publish {path}: {exc}')
+        state = 'published' if options['no_activate'] else 'published and activated'
+        self.stdout.write(self.style.SUCCESS(f'Version {version} {state}'))
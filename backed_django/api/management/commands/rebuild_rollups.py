@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.inference import get_registry, load_model
+from api.models import AttentionSession
+from api.rollups import has_rollups, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute attention rollups from the stored raw samples.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--session', type=int, action='append', dest='sessions',
+            help='Backfill only this session (repeatable); its scores are added to the existing rollups, so '
+                 'only sessions that were never rolled up are accepted.',
+        )
+        parser.add_argument('--step', type=int, default=10, help='Score every STEP-th window (default: 10).')
+
+    def handle(self, *args, **options):
+        # Score with the model the server uses: the active version of
+        # ATTENTION_MODEL_DIR, else ATTENTION_MODEL_PATH (see get_engine).
+        registry = get_registry()
+        if registry is not None:
+            registry.refresh(force=True)
+        if registry is not None and registry.model is not None:
+            model = registry.model
+        else:
+            path = getattr(settings, 'ATTENTION_MODEL_PATH', None)
+            try:
+                model = load_model(path)
+            except (OSError, RuntimeError, TypeError) as exc:
+                raise CommandError(f'Cannot load attention model from {path}: {exc}')
+
+        sessions = None
+        if options['sessions']:
+            sessions = AttentionSession.objects.filter(pk__in=options['sessions'])
+            scored = [session.pk for session in sessions if has_rollups(session)]
+            if scored:
+                raise CommandError('Sessions already in the rollups, a backfill would count them twice: '
+                                   + ', '.join(map(str, scored)))
+        rows = rebuild(model, settings.ATTENTION_WINDOW, options['step'], sessions)
+        action = 'Backfilled' if sessions is not None else 'Rebuilt'
+        self.stdout.write(self.style.SUCCESS(f'{action} {rows} rollup rows'))
@@ -0,0 +1,315 @@
+"""Course materials: resumable chunked uploads and range-aware downloads.
+
+Uploads follow a small tus-like protocol. The client creates an upload
+with the total ``size``, then sends the bytes with ``PATCH`` requests
+carrying ``Upload-Offset`` and, optionally, ``Upload-Checksum: sha256
+<hex>`` for the chunk. Each chunk is streamed to a temporary file as it
+is read from the request, then appended to a ``.part`` file under the
+upload's row lock. After an interruption the client reads the
+current offset back and continues from there. When the last byte arrives,
+and after the lock is released, the file is hashed once, indexed (size,
+duration, page count) and moved under ``MEDIA_ROOT/course_materials``.
+
+Downloads use ``FileResponse`` so the WSGI server can ``sendfile`` the
+file, and serve single ``Range`` requests with 206 responses.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import http_date, quote_etag
+from django.utils.text import slugify
+
+from .models import CourseMaterial
+
+READ_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = getattr(settings, 'MATERIAL_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+MAX_UPLOAD_SIZE = getattr(settings, 'MATERIAL_MAX_UPLOAD_SIZE', 4 * 1024 * 1024 * 1024)
+
+try:
+    import pypdf  # type: ignore
+except Exception:
+    pypdf = None
+
+
+class UploadError(Exception):
+    """A chunk could not be accepted; ``status`` is the HTTP status to return."""
+
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+def part_path(upload):
+    return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{upload.id}.part')
+
+
+def material_kind(filename):
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if content_type == 'application/pdf':
+        return CourseMaterial.KIND_PDF, content_type
+    if content_type.startswith('video/'):
+        return CourseMaterial.KIND_VIDEO, content_type
+    return CourseMaterial.KIND_OTHER, content_type
+
+
+def check_chunk(upload, offset, length):
+    if offset != upload.received:
+        raise UploadError(f'Expected offset {upload.received}', status=409)
+    if length > MAX_CHUNK_SIZE or offset + length > upload.size:
+        raise UploadError('Chunk too large', status=413)
+
+
+def receive_chunk(upload, stream, length, checksum=None):
+    """Read a chunk of ``length`` bytes from ``stream`` into a temporary file.
+
+    Runs before any lock is taken, however slow the client. The chunk is
+    discarded if it is short or does not match ``checksum`` (hex sha256).
+    Returns the path of the file.
+    """
+    directory = os.path.dirname(part_path(upload))
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f'{upload.id}.', suffix='.chunk', dir=directory)
+    try:
+        digest = hashlib.sha256()
+        written = 0
+        with os.fdopen(fd, 'wb') as f:
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                digest.update(data)
+                f.write(data)
+                written += len(data)
+        if written != length or (checksum and checksum.lower() != digest.hexdigest()):
+            raise UploadError('Incomplete chunk' if written != length else 'Checksum mismatch')
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def append_chunk(upload, chunk, offset, length):
+    """Append a chunk received by ``receive_chunk`` at ``offset``.
+
+    The caller must hold the write lock on the upload row, so that two
+    requests at the same offset cannot both append. Returns the new offset.
+    """
+    check_chunk(upload, offset, length)
+    with open(part_path(upload), 'ab') as f:
+        # The .part file may hold bytes of a chunk that failed mid-write.
+        f.truncate(offset)
+        with open(chunk, 'rb') as source:
+            shutil.copyfileobj(source, f, READ_SIZE)
+    return offset + length
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize(upload):
+    """Index a fully received upload and turn it into a ``CourseMaterial``."""
+    path = part_path(upload)
+    sha256 = file_sha256(path)
+    if upload.sha256 and upload.sha256.lower() != sha256:
+        os.remove(path)
+        raise UploadError('Checksum mismatch for the whole file')
+
+    kind, content_type = material_kind(upload.filename)
+    directory = slugify(upload.course) or 'course'
+    name = os.path.join('course_materials', directory, f'{upload.id.hex}_{os.path.basename(upload.filename)}')
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    target = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, target]) != root:
+        raise UploadError('Invalid file name')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    return CourseMaterial.objects.create(
+        course=upload.course,
+        title=upload.title or upload.filename,
+        kind=kind,
+        file=name,
+        content_type=content_type,
+        size=os.path.getsize(target),
+        sha256=sha256,
+        uploaded_by=upload.owner,
+        **extract_metadata(target, kind),
+    )
+
+
+def extract_metadata(path, kind):
+    if kind == CourseMaterial.KIND_PDF:
+        return {'page_count': pdf_page_count(path)}
+    if kind == CourseMaterial.KIND_VIDEO:
+        return {'duration': mp4_duration(path) or ffprobe_duration(path)}
+    return {}
+
+
+def pdf_page_count(path):
+    """Page count with pypdf when installed, else by counting page objects."""
+    if pypdf is not None:
+        try:
+            return len(pypdf.PdfReader(path).pages)
+        except Exception:
+            pass
+    pattern = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+    overlap = 32
+    count = 0
+    data = b''
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            data += block
+            # Matches starting in the last bytes are counted with the next block.
+            limit = len(data) if not block else len(data) - overlap
+            count += sum(1 for m in pattern.finditer(data) if m.start() < limit)
+            if not block:
+                break
+            data = data[max(limit, 0):]
+    return count or None
+
+
+def _boxes(f, end):
+    """Yield ``(type, payload_start, box_end)`` of the ISO-BMFF boxes up to ``end``."""
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, box = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield box, start + header, start + size
+        f.seek(start + size)
+
+
+def mp4_duration(path):
+    """Duration in seconds from the ``moov/mvhd`` box of an MP4/MOV file."""
+    try:
+        with open(path, 'rb') as f:
+            end = os.fstat(f.fileno()).st_size
+            for box, start, box_end in _boxes(f, end):
+                if box != b'moov':
+                    continue
+                f.seek(start)
+                for child, child_start, _ in _boxes(f, box_end):
+                    if child != b'mvhd':
+                        continue
+                    f.seek(child_start)
+                    version = f.read(1)[0]
+                    f.read(3)
+                    if version == 1:
+                        _, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+                    else:
+                        _, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+                    return duration / timescale if timescale else None
+    except (OSError, struct.error, IndexError):
+        pass
+    return None
+
+
+def ffprobe_duration(path):
+    """Duration via ffprobe for non-MP4 containers, when it is installed."""
+    if not shutil.which('ffprobe'):
+        return None
+    try:
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=30,
+        ).stdout
+        return float(out.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+def parse_range(header, size):
+    """Parse a single-range ``bytes=`` header into ``(start, end)`` inclusive.
+
+    Returns None for a missing or multi-range header (served in full) and
+    raises ``ValueError`` for an unsatisfiable one.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.group(0) == 'bytes=-':
+        return None
+    first, last = match.groups()
+    if not first:
+        length = int(last)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class _FileRange:
+    """File object limited to ``length`` bytes from its current position.
+
+    It keeps ``fileno`` so servers with ``wsgi.file_wrapper`` (gunicorn)
+    can still ``sendfile`` the range: they start at the current position
+    and send ``Content-Length`` bytes.
+    """
+
+    def __init__(self, f, start, length):
+        f.seek(start)
+        self._file = f
+        self._remaining = length
+        self.close = f.close
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+def material_response(request, material):
+    """Serve a material, honouring ``Range`` and ``If-Range``."""
+    path = material.file.path
+    stat = os.stat(path)
+    etag = quote_etag(material.sha256)
+    headers = {'Accept-Ranges': 'bytes', 'ETag': etag, 'Last-Modified': http_date(stat.st_mtime)}
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        if_range = request.headers.get('If-Range')
+        try:
+            byte_range = None if if_range and if_range != etag else parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        f = open(path, 'rb')
+        if byte_range is None:
+            response = FileResponse(f, content_type=material.content_type)
+        else:
+            start, end = byte_range
+            response = FileResponse(_FileRange(f, start, end - start + 1), status=206, content_type=material.content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    for name, value in headers.items():
+        response[name] = value
+    return response
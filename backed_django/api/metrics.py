@@ -0,0 +1,464 @@
+"""Per-request performance metrics in the Prometheus text format.
+
+``MetricsMiddleware`` records the following for every request, labelled
+with the URL route, view name and method:
+
+* latency, as a histogram;
+* a status-code counter;
+* the response size, as a histogram;
+* the number of SQL queries, as a histogram;
+* the total SQL time.
+
+``/api/metrics/`` renders these values, along with per-worker gauges:
+resident and anonymous memory, and the load time and mapped size of the
+attention model.
+
+Every process keeps its own registry. Under gunicorn each worker would
+otherwise only report its own share. So each worker writes a
+``<pid>.json`` snapshot to ``METRICS_DIR`` at most every
+``METRICS_FLUSH_INTERVAL`` seconds, and the endpoint sums all the
+snapshots. The snapshot of an exited process is folded into
+``archived.json`` (``archive``), so its counts still add up and a new
+process reusing its pid cannot make the sums go down. This happens when
+the endpoint finds the process gone, or when gunicorn reports a worker's
+exit (see ``gunicorn.conf.py``, which also empties the directory when the
+server starts).
+
+With ``METRICS_SLOW_REQUEST_MS`` set, the middleware also logs any
+request slower than that threshold to the ``api.metrics`` logger. The
+log includes the request's slowest SQL statements and a sampled profile.
+A background thread collects the profile by reading the request
+thread's stack every ``METRICS_PROFILE_INTERVAL_MS``.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+LABELS = ('route', 'view', 'method')
+MAX_LOGGED_STATEMENTS = 200
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Registry:
+    """Counters and histograms of one process, keyed by ``(name, labels)``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._flushed_pid = None
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self._lock:
+            data = self.histograms.get(key)
+            if data is None:
+                # One count per bucket, then the sum and the total count
+                data = self.histograms[key] = [0] * len(buckets) + [0, 0]
+            # Buckets are cumulative, as in the exposition format
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def snapshot(self):
+        gauges = [[name, list(labels), value] for collector in collectors for name, labels, value in collector()]
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(data)] for (name, labels), data in self.histograms.items()],
+                'gauges': gauges,
+            }
+
+    def flush(self, force=False):
+        """Write this process's snapshot to ``METRICS_DIR``, if set."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        now = time.monotonic()
+        if not directory or (not force and now - self._last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)):
+            return
+        self._last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        if self._flushed_pid != os.getpid():
+            # A snapshot with this pid was left by an earlier process.
+            archive(os.getpid())
+            self._flushed_pid = os.getpid()
+        _write(os.path.join(directory, f'{os.getpid()}.json'), self.snapshot())
+
+
+registry = Registry()
+
+
+def process_gauges():
+    """Memory of this process, from ``/proc`` where available."""
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return []
+    pid = (str(os.getpid()),)
+    gauges = []
+    for name, field in (('process_resident_memory_bytes', 'VmRSS'), ('process_anonymous_memory_bytes', 'RssAnon')):
+        if field in status:
+            gauges.append((name, pid, int(status[field].split()[0]) * 1024))
+    return gauges
+
+
+# Callables returning (name, labels, value) gauges of this process; see GAUGES
+collectors = [process_gauges]
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': LATENCY_BUCKETS,
+    'http_response_size_bytes': SIZE_BUCKETS,
+    'db_queries_per_request': QUERY_BUCKETS,
+}
+HELP = {
+    'http_request_duration_seconds': 'Request latency.',
+    'http_response_size_bytes': 'Response body size.',
+    'db_queries_per_request': 'SQL queries run by a request.',
+    'http_requests_total': 'Requests by response status.',
+    'db_query_duration_seconds_total': 'Time spent in SQL queries.',
+}
+# Per-process gauges: help and label names
+GAUGES = {
+    'process_resident_memory_bytes': ('Resident memory of a worker.', ('pid',)),
+    'process_anonymous_memory_bytes': ('Resident memory of a worker not backed by files.', ('pid',)),
+    'attention_model_load_seconds': ('Time to load and warm up the served model.', ('pid', 'version')),
+    'attention_model_mapped_bytes': ('Model weights mapped from disk and shared by the workers.', ('pid', 'version')),
+}
+
+
+ARCHIVE = 'archived.json'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, snapshot):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+@contextmanager
+def _locked(directory, exclusive=False):
+    """Lock the snapshots of ``directory`` against concurrent archiving."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reset():
+    """Remove the snapshots of a previous run from ``METRICS_DIR``."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return
+    with _locked(directory, exclusive=True):
+        for name in os.listdir(directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(directory, name))
+
+
+def archive(pid):
+    """Fold the snapshot of the exited process ``pid`` into ``archived.json``."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory or not os.path.isdir(directory):
+        return
+    path = os.path.join(directory, f'{pid}.json')
+    with _locked(directory, exclusive=True):
+        snapshot = _read(path)
+        if snapshot is None:
+            return
+        archived = _read(os.path.join(directory, ARCHIVE)) or {'pid': None, 'counters': [], 'histograms': []}
+        counters, histograms, _ = _merge([archived, snapshot], live=False)
+        _write(os.path.join(directory, ARCHIVE), {
+            'pid': None,
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'histograms': [[name, list(labels), data] for (name, labels), data in histograms.items()],
+        })
+        os.remove(path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def collect():
+    """Merge the snapshots of every worker (or only this process's registry)."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        snapshots = [registry.snapshot()]
+    else:
+        registry.flush(force=True)
+        for name in os.listdir(directory):
+            pid = name[:-len('.json')]
+            if name.endswith('.json') and pid.isdigit() and int(pid) != os.getpid() and not _alive(int(pid)):
+                archive(pid)
+        with _locked(directory):
+            snapshots = [_read(os.path.join(directory, name))
+                         for name in os.listdir(directory) if name.endswith('.json')]
+    return _merge([snapshot for snapshot in snapshots if snapshot is not None])
+
+
+def _merge(snapshots, live=True):
+    counters, histograms, gauges = {}, {}, {}
+    for snapshot in snapshots:
+        # Gauges are per process and not summed; those of exited workers are left out.
+        pid = snapshot.get('pid')
+        if live and pid and (pid == os.getpid() or _alive(pid)):
+            for name, labels, value in snapshot.get('gauges', ()):
+                gauges[(name, tuple(labels))] = value
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, data in snapshot['histograms']:
+            key = (name, tuple(labels))
+            merged = histograms.setdefault(key, [0] * len(data))
+            for i, value in enumerate(data):
+                merged[i] += value
+    return counters, histograms, gauges
+
+
+def _labels(names, values, extra=''):
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+    parts = [f'{n}="{v}"' for n, v in zip(names, escaped)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}'
+
+
+def render():
+    """Merged metrics in the Prometheus text exposition format."""
+    counters, histograms, gauges = collect()
+    lines = []
+    for name, buckets in HISTOGRAMS.items():
+        series = sorted((labels, data) for (n, labels), data in histograms.items() if n == name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {HELP[name]}', f'# TYPE {name} histogram']
+        for labels, data in series:
+            for bound, count in zip(buckets + ('+Inf',), data[:-2] + data[-1:]):
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{_labels(LABELS, labels, le)} {count}')
+            lines.append(f'{name}_sum{_labels(LABELS, labels)} {data[-2]}')
+            lines.append(f'{name}_count{_labels(LABELS, labels)} {data[-1]}')
+    for name, label_names in (('http_requests_total', LABELS + ('status',)),
+                              ('db_query_duration_seconds_total', LABELS)):
+        series = sorted((labels, value) for (n, labels), value in counters.items() if n == name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {HELP[name]}', f'# TYPE {name} counter']
+        lines += [f'{name}{_labels(label_names, labels)} {value}' for labels, value in series]
+    for name, (text, label_names) in GAUGES.items():
+        series = sorted((labels, value) for (n, labels), value in gauges.items() if n == name)
+        if not series:
+            continue
+        lines += [f'# HELP {name} {text}', f'# TYPE {name} gauge']
+        lines += [f'{name}{_labels(label_names, labels)} {value}' for labels, value in series]
+    return '\n'.join(lines) + '\n'
+
+
+class StackSampler:
+    """Counts the stacks of registered threads, sampled from a daemon thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wake = threading.Event()
+        self._pid = None
+
+    def start(self, ident):
+        counts = Counter()
+        with self._lock:
+            self._active[ident] = counts
+            if self._pid != os.getpid():
+                # First use in this (possibly forked) process
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='metrics-sampler', daemon=True).start()
+        self._wake.set()
+        return counts
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = list(self._active.items())
+                if not active:
+                    self._wake.clear()
+            if not active:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for ident, counts in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    counts[_stack(frame)] += 1
+            time.sleep(getattr(settings, 'METRICS_PROFILE_INTERVAL_MS', 5) / 1000)
+
+
+def _stack(frame, depth=8):
+    stack = []
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append(f'{code.co_filename}:{frame.f_lineno} {code.co_name}')
+        frame = frame.f_back
+    return tuple(stack)
+
+
+sampler = StackSampler()
+
+
+class QueryProbe:
+    """Database execute wrapper counting and timing the queries of a request."""
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = [] if keep_statements else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.statements is not None and len(self.statements) < MAX_LOGGED_STATEMENTS:
+                self.statements.append((elapsed, sql))
+
+
+@contextmanager
+def _attached(conns, probe):
+    for conn in conns:
+        conn.execute_wrappers.append(probe)
+    try:
+        yield
+    finally:
+        for conn in conns:
+            if probe in conn.execute_wrappers:
+                conn.execute_wrappers.remove(probe)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        slow_ms = getattr(settings, 'METRICS_SLOW_REQUEST_MS', None)
+        probe = QueryProbe(keep_statements=slow_ms is not None)
+        conns = connections.all()
+        ident = threading.get_ident()
+        profile = sampler.start(ident) if slow_ms is not None else None
+        start = time.perf_counter()
+        try:
+            with _attached(conns, probe):
+                response = self.get_response(request)
+        finally:
+            if profile is not None:
+                sampler.stop(ident)
+
+        def finish(size):
+            self.record(request, response, probe, profile, time.perf_counter() - start, size, slow_ms)
+
+        length = response.get('Content-Length')
+        if length is not None:
+            # Also covers FileResponse, whose file must stay untouched for sendfile.
+            finish(int(length))
+        elif response.streaming and not getattr(response, 'is_async', False):
+            # Streamed lists run their queries while the body is sent.
+            response.streaming_content = self._measure(response.streaming_content, conns, probe, finish)
+        else:
+            finish(0 if response.streaming else len(response.content))
+        return response
+
+    @staticmethod
+    def _measure(content, conns, probe, finish):
+        size = 0
+        iterator = iter(content)
+        try:
+            while True:
+                # Attached only while producing a part: a body that is never
+                # read must not leave the probe on the connections.
+                with _attached(conns, probe):
+                    part = next(iterator, None)
+                if part is None:
+                    break
+                size += len(part)
+                yield part
+        finally:
+            finish(size)
+
+    def record(self, request, response, probe, profile, elapsed, size, slow_ms):
+        match = request.resolver_match
+        labels = (match.route, match.view_name) if match else ('', '')
+        labels += (request.method,)
+        registry.observe('http_request_duration_seconds', labels, elapsed, LATENCY_BUCKETS)
+        registry.observe('http_response_size_bytes', labels, size, SIZE_BUCKETS)
+        registry.observe('db_queries_per_request', labels, probe.count, QUERY_BUCKETS)
+        registry.inc('db_query_duration_seconds_total', labels, probe.duration)
+        registry.inc('http_requests_total', labels + (str(response.status_code),))
+        registry.flush()
+        if slow_ms is not None and elapsed * 1000 >= slow_ms:
+            log_slow_request(request, response, elapsed, probe, profile)
+
+
+def log_slow_request(request, response, elapsed, probe, profile, top=10):
+    lines = [f'Slow request {request.method} {request.get_full_path()} -> {response.status_code} '
+             f'in {elapsed * 1000:.1f} ms, {probe.count} queries in {probe.duration * 1000:.1f} ms']
+    for duration, sql in sorted(probe.statements or (), key=lambda s: s[0], reverse=True)[:top]:
+        lines.append(f'  sql {duration * 1000:.1f} ms: {sql}')
+    samples = sum(profile.values()) if profile else 0
+    for stack, count in (profile.most_common(top) if profile else ()):
+        lines.append(f'  profile {count}/{samples} samples:')
+        lines.extend(f'    {frame}' for frame in stack)
+    logger.warning('\n'.join(lines))
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttentionSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course', models.CharField(blank=True, default='', max_length=64)),
+                ('classroom', models.CharField(blank=True, default='', max_length=64)),
+                ('feature_count', models.PositiveSmallIntegerField()),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('frame_count', models.PositiveIntegerField(default=0)),
+                ('chunk_count', models.PositiveIntegerField(default=0)),
+                ('last_ts', models.FloatField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attention_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SampleChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('start_ts', models.FloatField()),
+                ('end_ts', models.FloatField()),
+                ('frame_count', models.PositiveIntegerField()),
+                ('timestamps', models.BinaryField()),
+                ('features', models.BinaryField()),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.attentionsession')),
+            ],
+            options={
+                'ordering': ['session', 'seq'],
+                'indexes': [models.Index(fields=['session', 'start_ts'], name='api_samplec_session_77aa63_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='samplechunk',
+            constraint=models.UniqueConstraint(fields=('session', 'seq'), name='unique_chunk_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='attentionsession',
+            index=models.Index(fields=['user', 'started_at'], name='api_attenti_user_id_f1d7f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attentionsession',
+            index=models.Index(fields=['classroom', 'started_at'], name='api_attenti_classro_063cda_idx'),
+        ),
+    ]
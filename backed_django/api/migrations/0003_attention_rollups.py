@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_attention_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttentionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('student', 'student'), ('course', 'course'), ('class', 'class'), ('global', 'global')], max_length=8)),
+                ('key', models.CharField(max_length=64)),
+                ('granularity', models.CharField(choices=[('minute', 'minute'), ('hour', 'hour'), ('day', 'day'), ('week', 'week')], max_length=6)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('low_count', models.PositiveIntegerField(default=0)),
+                ('medium_count', models.PositiveIntegerField(default=0)),
+                ('high_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='attentionrollup',
+            constraint=models.UniqueConstraint(fields=('scope', 'key', 'granularity', 'bucket'), name='unique_rollup_bucket'),
+        ),
+    ]
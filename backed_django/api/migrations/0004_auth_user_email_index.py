@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 06:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The email login path looks users up by email, which auth.User does not index.
+INDEX = models.Index(fields=['email'], name='api_user_email_idx')
+
+
+def user_model(apps):
+    return apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+
+def add_email_index(apps, schema_editor):
+    schema_editor.add_index(user_model(apps), INDEX)
+
+
+def remove_email_index(apps, schema_editor):
+    schema_editor.remove_index(user_model(apps), INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0003_attention_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_email_index, remove_email_index),
+    ]
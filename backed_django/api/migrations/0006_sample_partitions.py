@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_course_materials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SampleAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.BigIntegerField()),
+                ('start_ts', models.FloatField()),
+                ('seconds', models.PositiveIntegerField()),
+                ('frame_count', models.PositiveIntegerField()),
+                ('mean', models.BinaryField()),
+                ('std', models.BinaryField()),
+            ],
+            options={
+                'ordering': ['session_id', 'start_ts'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SamplePartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=63, unique=True)),
+                ('course', models.CharField(blank=True, default='', max_length=64)),
+                ('week_start', models.FloatField()),
+                ('week_end', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attentionsession',
+            name='first_ts',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.DeleteModel(
+            name='SampleChunk',
+        ),
+        migrations.AddConstraint(
+            model_name='samplepartition',
+            constraint=models.UniqueConstraint(fields=('course', 'week_start'), name='unique_partition_week'),
+        ),
+        migrations.AddConstraint(
+            model_name='sampleaggregate',
+            constraint=models.UniqueConstraint(fields=('session_id', 'start_ts'), name='unique_aggregate_bucket'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_provisioning_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionSummary',
+            fields=[
+                ('session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='api.attentionsession')),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('mean_score', models.FloatField(blank=True, null=True)),
+                ('std_score', models.FloatField(blank=True, null=True)),
+                ('seconds', models.FloatField(default=0)),
+                ('distraction_episodes', models.PositiveIntegerField(default=0)),
+                ('distracted_seconds', models.FloatField(default=0)),
+                ('phases', models.JSONField(default=dict)),
+                ('episodes', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
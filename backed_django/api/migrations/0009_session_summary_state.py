@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_session_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sessionsummary',
+            name='state',
+            field=models.JSONField(default=dict),
+        ),
+    ]
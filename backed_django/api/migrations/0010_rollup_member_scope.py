@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_session_summary_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attentionrollup',
+            name='key',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='attentionrollup',
+            name='scope',
+            field=models.CharField(choices=[('student', 'student'), ('course', 'course'), ('class', 'class'), ('member', 'member'), ('global', 'global')], max_length=8),
+        ),
+    ]
@@ -1,4 +1,8 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 class Message(models.Model):
@@ -7,3 +11,247 @@ class Message(models.Model):
     def __str__(self):
         return self.text
 
+
+class AttentionSession(models.Model):
+    """A monitoring session of one student, from camera start to stop."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attention_sessions')
+    course = models.CharField(max_length=64, blank=True, default='')
+    classroom = models.CharField(max_length=64, blank=True, default='')
+    feature_count = models.PositiveSmallIntegerField()
+    started_at = models.DateTimeField(default=timezone.now)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    # Running counters maintained by the ingestion path
+    frame_count = models.PositiveIntegerField(default=0)
+    chunk_count = models.PositiveIntegerField(default=0)
+    first_ts = models.FloatField(null=True, blank=True)
+    last_ts = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'started_at']),
+            models.Index(fields=['classroom', 'started_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}@{self.started_at:%Y-%m-%d %H:%M}'
+
+    @property
+    def is_open(self):
+        return self.ended_at is None
+
+
+class SampleChunk(models.Model):
+    """A contiguous run of feature frames of one session, stored packed.
+
+    ``timestamps`` holds ``frame_count`` little-endian float64 values
+    (milliseconds since the epoch) and ``features`` holds
+    ``frame_count * session.feature_count`` little-endian float32 values
+    in row-major order, so one row covers hundreds of frames.
+
+    Chunks live in the samples database, in one table per course and week
+    (see ``api.samplestore``); this abstract model is the schema of those
+    tables. ``session_id`` refers to an ``AttentionSession`` of the default
+    database, so it is not a foreign key.
+    """
+    session_id = models.BigIntegerField()
+    seq = models.PositiveIntegerField()
+    start_ts = models.FloatField()
+    end_ts = models.FloatField()
+    frame_count = models.PositiveIntegerField()
+    timestamps = models.BinaryField()
+    features = models.BinaryField()
+
+    class Meta:
+        abstract = True
+        ordering = ['session_id', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['session_id', 'seq'], name='%(class)s_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['session_id', 'start_ts'], name='%(class)s_ts'),
+        ]
+
+    def __str__(self):
+        return f'{self.session_id}#{self.seq} ({self.frame_count} frames)'
+
+
+class SamplePartition(models.Model):
+    """Catalog entry of the ``SampleChunk`` table of one course and week."""
+    table = models.CharField(max_length=63, unique=True)
+    course = models.CharField(max_length=64, blank=True, default='')
+    # Milliseconds since the epoch, [week_start, week_end)
+    week_start = models.FloatField()
+    week_end = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'week_start'], name='unique_partition_week'),
+        ]
+
+    def __str__(self):
+        return self.table
+
+
+class SampleAggregate(models.Model):
+    """Per-session statistics of the frames of one time bucket.
+
+    Written by ``compact_samples`` before the raw chunks of a partition are
+    dropped. ``mean`` and ``std`` hold one little-endian float32 per feature.
+    """
+    session_id = models.BigIntegerField()
+    start_ts = models.FloatField()
+    seconds = models.PositiveIntegerField()
+    frame_count = models.PositiveIntegerField()
+    mean = models.BinaryField()
+    std = models.BinaryField()
+
+    class Meta:
+        ordering = ['session_id', 'start_ts']
+        constraints = [
+            models.UniqueConstraint(fields=['session_id', 'start_ts'], name='unique_aggregate_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.session_id}@{self.start_ts:.0f} ({self.frame_count} frames)'
+
+
+class AttentionRollup(models.Model):
+    """Pre-aggregated attention scores of one student, course, class or the
+    whole platform over one minute, hour, day or week bucket.
+
+    ``member`` rows hold the daily scores of one student in one class, keyed
+    ``<classroom>:<user id>``.
+
+    Maintained incrementally by ``api.rollups`` as scores are produced, so
+    reports never read raw samples.
+    """
+    SCOPE_STUDENT = 'student'
+    SCOPE_COURSE = 'course'
+    SCOPE_CLASS = 'class'
+    SCOPE_MEMBER = 'member'
+    SCOPE_GLOBAL = 'global'
+    SCOPE_CHOICES = [(s, s) for s in (SCOPE_STUDENT, SCOPE_COURSE, SCOPE_CLASS, SCOPE_MEMBER, SCOPE_GLOBAL)]
+    GRANULARITY_CHOICES = [(g, g) for g in ('minute', 'hour', 'day', 'week')]
+
+    scope = models.CharField(max_length=8, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=100)
+    granularity = models.CharField(max_length=6, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+    low_count = models.PositiveIntegerField(default=0)
+    medium_count = models.PositiveIntegerField(default=0)
+    high_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'granularity', 'bucket'], name='unique_rollup_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope}:{self.key} {self.granularity} {self.bucket:%Y-%m-%d %H:%M}'
+
+    @property
+    def score(self):
+        return self.score_sum / self.count if self.count else None
+
+
+class SessionSummary(models.Model):
+    """Attention statistics of a session, written by ``api.analytics``.
+
+    Updated with every score, so partial until the session has ended.
+    ``state`` holds the tracker the next score is added to.
+
+    ``phases`` maps each Pomodoro phase to its statistics and ``episodes``
+    lists the latest distraction episodes; durations are in seconds.
+    """
+    session = models.OneToOneField(AttentionSession, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='summary')
+    samples = models.PositiveIntegerField(default=0)
+    mean_score = models.FloatField(null=True, blank=True)
+    std_score = models.FloatField(null=True, blank=True)
+    seconds = models.FloatField(default=0)
+    distraction_episodes = models.PositiveIntegerField(default=0)
+    distracted_seconds = models.FloatField(default=0)
+    phases = models.JSONField(default=dict)
+    episodes = models.JSONField(default=list)
+    state = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.session_id}: {self.samples} scores, {self.distraction_episodes} episodes'
+
+
+class CourseMaterial(models.Model):
+    """A PDF, video or other file of a course, with its metadata index.
+
+    ``size``, ``sha256``, ``duration`` (videos, seconds) and ``page_count``
+    (PDFs) are computed once when the upload completes.
+    """
+    KIND_PDF = 'pdf'
+    KIND_VIDEO = 'video'
+    KIND_OTHER = 'other'
+    KIND_CHOICES = [(k, k) for k in (KIND_PDF, KIND_VIDEO, KIND_OTHER)]
+
+    course = models.CharField(max_length=64, db_index=True)
+    title = models.CharField(max_length=255)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    file = models.FileField(upload_to='course_materials/', max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    duration = models.FloatField(null=True, blank=True)
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    uploaded_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.title
+
+
+class MaterialUpload(models.Model):
+    """A resumable upload in progress; bytes go to a ``.part`` file on disk."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='material_uploads')
+    course = models.CharField(max_length=64)
+    title = models.CharField(max_length=255)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # Optional checksum of the whole file announced by the client
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    material = models.OneToOneField(CourseMaterial, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
+
+    @property
+    def complete(self):
+        return self.material_id is not None
+
+
+class ProvisioningJob(models.Model):
+    """A roster of users being created by ``api.provisioning``.
+
+    ``report`` holds one entry per roster row once the job is done.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [(s, s) for s in (STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED)]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.PositiveIntegerField(default=0)
+    report = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.pk} ({self.status}, {self.total} rows)'
@@ -0,0 +1,136 @@
+"""Versioned attention model weights, memory-mapped and hot-swappable.
+
+Layout of ``ATTENTION_MODEL_DIR``::
+
+    versions/<version>/<array>.npy   one float32 array per NumpyLSTM weight
+    versions/<version>/meta.json
+    current                          name of the active version
+
+Weights are opened with ``numpy.load(mmap_mode='r')``, so they are not
+copied into the heap. Every worker maps the same page-cache pages, and
+when the app is preloaded (``gunicorn.conf.py``) they are also mapped
+once before the fork. Versions are published into a temporary directory
+and renamed into place. ``current`` is replaced with ``os.replace``, so
+switching versions is atomic. Workers pick up the change within
+``ATTENTION_MODEL_CHECK_INTERVAL`` seconds, without a restart.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .inference import NumpyLSTM
+
+logger = logging.getLogger(__name__)
+
+
+def _versions(root):
+    return os.path.join(root, 'versions')
+
+
+def current_version(root):
+    try:
+        with open(os.path.join(root, 'current')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(root):
+    try:
+        return sorted(name for name in os.listdir(_versions(root)) if not name.startswith('.'))
+    except FileNotFoundError:
+        return []
+
+
+def activate(root, version):
+    """Make ``version`` the one workers serve."""
+    if not os.path.isdir(os.path.join(_versions(root), version)):
+        raise FileNotFoundError(f'No model version {version!r} in {root}')
+    tmp = os.path.join(root, '.current.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, 'current'))
+
+
+def publish(root, model, version=None, make_current=True):
+    """Store the weights of a ``NumpyLSTM`` as a new version; returns its name."""
+    version = version or time.strftime('%Y%m%d-%H%M%S')
+    target = os.path.join(_versions(root), version)
+    if os.path.exists(target):
+        raise FileExistsError(f'Model version {version!r} already exists')
+    os.makedirs(_versions(root), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.publish-', dir=_versions(root))
+    try:
+        for name, array in model.arrays().items():
+            np.save(os.path.join(tmp, f'{name}.npy'), np.ascontiguousarray(array, dtype='<f4'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'feature_count': model.feature_count, 'units': model.units,
+                       'published_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}, f)
+        os.rename(tmp, target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    if make_current:
+        activate(root, version)
+    return version
+
+
+def load_version(root, version):
+    """Memory-map the weights of a published version."""
+    path = os.path.join(_versions(root), version)
+    arrays = {
+        name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+        for name in os.listdir(path) if name.endswith('.npy')
+    }
+    return NumpyLSTM(**arrays)
+
+
+def mapped_bytes(model):
+    arrays = model.arrays().values() if isinstance(model, NumpyLSTM) else ()
+    return sum(a.nbytes for a in arrays if isinstance(a, np.memmap) or isinstance(a.base, np.memmap))
+
+
+class ModelRegistry:
+    """Tracks the active version of a model directory and keeps it loaded."""
+
+    def __init__(self, root, window=30, check_interval=5):
+        self.root = str(root)
+        self.window = window
+        self.check_interval = check_interval
+        self.version = None
+        self.model = None
+        self.load_seconds = None
+        self._checked = None
+        self._failed = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Load the active version if it changed; True when a new model was loaded."""
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            version = current_version(self.root)
+            if version is None or version in (self.version, self._failed):
+                return False
+            start = time.perf_counter()
+            try:
+                model = load_version(self.root, version)
+                # Faults the weights in and runs the first, slowest forward
+                # pass here rather than in a request.
+                model.forward(np.zeros((1, self.window, model.feature_count), dtype=np.float32))
+            except (OSError, ValueError, TypeError):
+                logger.exception('Cannot load attention model version %s; keeping %s', version, self.version)
+                self._failed = version
+                return False
+            self.load_seconds = time.perf_counter() - start
+            self.model, self.version = model, version
+            logger.info('Loaded attention model version %s in %.3fs', version, self.load_seconds)
+            return True
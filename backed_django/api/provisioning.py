@@ -0,0 +1,245 @@
+"""Bulk provisioning of users from a CSV or JSON roster.
+
+A roster row has an ``email`` and, optionally:
+- ``password``; without one the user gets an unusable password and must
+  reset it;
+- ``full_name`` (or ``fullName``/``name``);
+- ``role``: student, teacher or admin, also accepted in Spanish.
+Teachers are staff users and admins are also superusers; only
+``allow_admins`` (a superuser) may create either.
+
+All rows are validated first. Existing emails and usernames are then
+looked up with one query each. Passwords are hashed in a process pool,
+so PBKDF2 runs on every core instead of in the web worker. Users and
+their tokens are inserted with ``bulk_create``. The result is one report
+entry per row. With ``dry_run`` nothing is hashed or written.
+"""
+import csv
+import io
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+ROLES = {
+    'student': (False, False), 'estudiante': (False, False),
+    'teacher': (True, False), 'docente': (True, False),
+    'admin': (True, True), 'administrador': (True, True),
+}
+BATCH_SIZE = 500
+MAX_ROWS = getattr(settings, 'PROVISIONING_MAX_ROWS', 20000)
+# Below this many passwords, starting a pool costs more than it saves.
+MIN_POOL_PASSWORDS = 8
+
+
+class RosterError(ValueError):
+    """The roster as a whole cannot be read."""
+
+
+class RosterParser(BaseParser):
+    """DRF parser passing a CSV roster through as text."""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return stream.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ParseError('Rosters must be encoded in UTF-8')
+
+
+def read_roster(data, format=None):
+    """Rows of a roster given as CSV text, JSON text or already decoded JSON."""
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise RosterError('Rosters must be encoded in UTF-8')
+    if isinstance(data, str):
+        if format == 'json' or (format is None and data.lstrip()[:1] in ('[', '{')):
+            try:
+                data = json.loads(data)
+            except ValueError as exc:
+                raise RosterError(f'Invalid JSON: {exc}')
+        else:
+            data = list(csv.DictReader(io.StringIO(data)))
+    if isinstance(data, dict):
+        data = data.get('users')
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise RosterError('Expected a list of users')
+    if len(data) > MAX_ROWS:
+        raise RosterError(f'At most {MAX_ROWS} users per roster')
+    return data
+
+
+def _text(row, *keys):
+    for key in keys:
+        value = row.get(key)
+        if value not in (None, ''):
+            return str(value).strip()
+    return ''
+
+
+def _plan(rows, allow_admins):
+    """Validate rows; returns the report and the entries to create."""
+    User = get_user_model()
+    report, pending, seen = [], [], set()
+    for number, row in enumerate(rows, start=1):
+        email = User.objects.normalize_email(_text(row, 'email'))
+        entry = {'row': number, 'email': email}
+        report.append(entry)
+        role = (_text(row, 'role', 'rol') or 'student').lower()
+        try:
+            validate_email(email)
+        except ValidationError:
+            entry.update(status='invalid', detail='Invalid email')
+            continue
+        if role not in ROLES:
+            entry.update(status='invalid', detail=f'Unknown role {role!r}')
+            continue
+        if ROLES[role][0] and not allow_admins:
+            entry.update(status='invalid', detail='Only superusers can create staff accounts')
+            continue
+        if email in seen:
+            entry.update(status='duplicate', detail='Email repeated in the roster')
+            continue
+        seen.add(email)
+        pending.append((entry, {
+            'email': email,
+            'password': _text(row, 'password') or None,
+            'first_name': _text(row, 'full_name', 'fullName', 'name')[:150],
+            'is_staff': ROLES[role][0],
+            'is_superuser': ROLES[role][1],
+        }))
+
+    existing = set(User.objects.filter(email__in=[f['email'] for _, f in pending]).values_list('email', flat=True))
+    # Usernames are the local part of the email, as in RegisterView, or the
+    # whole email when that local part is taken.
+    locals_ = [f['email'].split('@')[0] for _, f in pending]
+    taken = set(User.objects.filter(username__in=locals_ + [f['email'] for _, f in pending])
+                .values_list('username', flat=True))
+    to_create = []
+    for (entry, fields), local in zip(pending, locals_):
+        if fields['email'] in existing:
+            entry.update(status='exists', detail='A user with this email already exists')
+            continue
+        username = local if local not in taken else fields['email']
+        if username in taken:
+            entry.update(status='exists', detail=f'Username {username!r} is taken')
+            continue
+        taken.add(username)
+        entry['username'] = username
+        to_create.append((entry, dict(fields, username=username)))
+    return report, to_create
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords, in a pool of ``workers`` processes when there are many.
+
+    ``None`` entries get an unusable password without running the hasher.
+    """
+    workers = workers or getattr(settings, 'PROVISIONING_HASH_WORKERS', None) or os.cpu_count() or 1
+    indexes = [i for i, p in enumerate(passwords) if p is not None]
+    hashed = [make_password(None) if p is None else None for p in passwords]
+    if workers > 1 and len(indexes) >= MIN_POOL_PASSWORDS:
+        # Spawned, not forked, as the web process runs other threads. Workers
+        # inherit DJANGO_SETTINGS_MODULE, which is all make_password needs;
+        # they must not import this module, whose models need django.setup().
+        with ProcessPoolExecutor(workers, mp_context=get_context('spawn')) as pool:
+            chunksize = max(1, len(indexes) // (workers * 4))
+            values = pool.map(make_password, [passwords[i] for i in indexes], chunksize=chunksize)
+            for i, value in zip(indexes, values):
+                hashed[i] = value
+    else:
+        for i in indexes:
+            hashed[i] = make_password(passwords[i])
+    return hashed
+
+
+def _insert(User, batch):
+    """Insert one batch of ``(entry, user)``; rows that conflict are reported, not raised."""
+    try:
+        with transaction.atomic():
+            created = User.objects.bulk_create([user for _, user in batch])
+            if any(user.pk is None for user in created):
+                # Backends that cannot return keys from a bulk insert
+                ids = dict(User.objects.filter(username__in=[u.username for u in created])
+                           .values_list('username', 'pk'))
+                for user in created:
+                    user.pk = ids[user.username]
+            Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in created])
+    except IntegrityError:
+        # A user created concurrently; fall back to one row at a time.
+        for entry, user in batch:
+            try:
+                with transaction.atomic():
+                    user.save(force_insert=True)
+                    Token.objects.create(user=user)
+            except IntegrityError:
+                user.pk = None
+                entry.update(status='exists', detail='Created concurrently by another request')
+                entry.pop('username', None)
+        batch = [(entry, user) for entry, user in batch if user.pk is not None]
+    for entry, user in batch:
+        entry.update(status='created', id=user.pk)
+
+
+def provision(rows, dry_run=False, workers=None, allow_admins=True):
+    """Create the users of a roster; returns the per-row report."""
+    User = get_user_model()
+    report, to_create = _plan(rows, allow_admins)
+    if dry_run:
+        for entry, _ in to_create:
+            entry['status'] = 'would_create'
+        return report
+
+    hashed = hash_passwords([fields.pop('password') for _, fields in to_create], workers)
+    users = [(entry, User(password=password, **fields)) for (entry, fields), password in zip(to_create, hashed)]
+    for start in range(0, len(users), BATCH_SIZE):
+        _insert(User, users[start:start + BATCH_SIZE])
+    return report
+
+
+def summarize(report):
+    return dict(Counter(entry['status'] for entry in report))
+
+
+def run_job(job, rows, allow_admins=True):
+    """Provision ``rows`` for a ``ProvisioningJob``, recording its progress."""
+    job.status = job.STATUS_RUNNING
+    job.save(update_fields=['status'])
+    try:
+        job.report = provision(rows, allow_admins=allow_admins)
+        job.status = job.STATUS_DONE
+    except Exception as exc:
+        job.status = job.STATUS_FAILED
+        job.error = str(exc)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'report', 'error', 'finished_at'])
+
+
+def start_job(job, rows, allow_admins=True):
+    """Run a job in a background thread (or inline, see PROVISIONING_BACKGROUND)."""
+    if not getattr(settings, 'PROVISIONING_BACKGROUND', True):
+        run_job(job, rows, allow_admins)
+        return
+
+    def target():
+        try:
+            run_job(job, rows, allow_admins)
+        finally:
+            close_old_connections()
+
+    threading.Thread(target=target, name=f'provisioning-{job.pk}', daemon=True).start()
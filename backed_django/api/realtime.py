@@ -0,0 +1,321 @@
+"""Push channel for attention scores over ASGI WebSockets.
+
+Two sockets are served next to the Django HTTP application (see
+``monitoring/asgi.py``):
+
+``/ws/sessions/<id>/``
+    A student streams ``{"frames": [...], "phase": ...}`` batches, or
+    binary frame batches (see ``api.wire``), for one of their sessions and
+    gets the ingestion result and current score back. ``phase`` is the
+    current Pomodoro phase (see ``api.analytics``). Binary batches keep the
+    last phase sent.
+
+``/ws/classes/<classroom>/``
+    A teacher (staff user) receives every score published for the class,
+    a ``low_attention`` alert when a student drops to the low level, a
+    ``distraction_episode`` alert when a student stays distracted during a
+    work phase, and the ``session_summary`` of every closed session.
+
+Browsers cannot set headers on a WebSocket, so the API token is passed as
+``?token=<key>``. Messages are fanned out through the broker named by
+``ATTENTION_BROKER``; the default ``InProcessBroker`` only reaches sockets
+served by the same process.
+"""
+import asyncio
+import json
+import re
+import threading
+from concurrent.futures import TimeoutError
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import analytics, samplestore, wire
+from .authentication import CachedTokenAuthentication
+from .inference import get_engine
+from .ingestion import SessionClosed, ingest_batch
+from .models import AttentionSession
+from .rollups import record_scores
+
+
+class InProcessBroker:
+    """Fan-out of messages to asyncio subscribers of the current process.
+
+    ``publish`` may be called from any thread. Each subscriber gets a
+    bounded queue; when a slow consumer falls behind its oldest messages
+    are discarded.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._channels.get(channel, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._channels.pop(channel, None)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, message)
+
+    @staticmethod
+    def _put(queue, message):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'ATTENTION_BROKER', 'api.realtime.InProcessBroker'))()
+    return _broker
+
+
+def class_channel(classroom):
+    return f'class:{classroom}'
+
+
+def publish_attention(session, result, previous=None, events=()):
+    """Publish a session's score to its class feed, alerting on a drop to low.
+
+    ``events`` are the alerts raised by ``api.analytics`` for this score.
+    """
+    if not session.classroom or result is None:
+        return
+    broker = get_broker()
+    channel = class_channel(session.classroom)
+    message = {'student': session.user_id, 'session': session.pk, **result}
+    broker.publish(channel, {'type': 'attention', **message})
+    if result['level'] == 'low' and (previous is None or previous['level'] != 'low'):
+        broker.publish(channel, {'type': 'low_attention', **message})
+    for event in events:
+        broker.publish(channel, {**message, **event})
+
+
+def publish_summary(session, summary):
+    """Publish the ``SessionSummary`` of a closed session to its class feed."""
+    if not session.classroom or summary is None:
+        return
+    get_broker().publish(class_channel(session.classroom), {
+        'type': 'session_summary', 'student': session.user_id, 'session': session.pk,
+        'samples': summary.samples, 'score': summary.mean_score, 'seconds': summary.seconds,
+        'distraction_episodes': summary.distraction_episodes, 'distracted_seconds': summary.distracted_seconds,
+    })
+
+
+def _scored(session, attention, previous, phase=None):
+    if attention is None:
+        return
+    now = timezone.now()
+    record_scores(session, [(now, attention['score'])])
+    events = analytics.observe(session, attention, now.timestamp() * 1000, phase)
+    publish_attention(session, attention, previous, events)
+
+
+def _ingest(session, frames):
+    result, features = ingest_batch(session.pk, frames)
+    engine = get_engine()
+    if engine is None or not len(features) or session.feature_count != engine.model.feature_count:
+        return result, None, None
+    previous = engine.latest(session.pk)
+    if engine.observe(session.pk, features, result['frame_count']) is None:
+        _reseed(engine, session)
+    result['attention'] = None
+    return result, engine.submit(session.pk), previous
+
+
+def _reseed(engine, session):
+    # Earlier frames of the session were received by another worker: the
+    # window is rebuilt from the store so it never scores a gapped sequence.
+    session.refresh_from_db(fields=['frame_count', 'chunk_count', 'first_ts', 'last_ts'])
+    engine.seed(session.pk, samplestore.last_features(session, engine.window), session.frame_count)
+
+
+def latest_attention(session, timeout=1.0):
+    """The score of the latest frames of ``session``, as stored.
+
+    Scores them first when this process's window lags the session, as it
+    does when its batches were ingested by other workers.
+    """
+    engine = get_engine()
+    if engine is None or session.feature_count != engine.model.feature_count:
+        return None
+    if session.frame_count and engine.position(session.pk) != session.frame_count:
+        _reseed(engine, session)
+        future = engine.submit(session.pk)
+        if future is not None:
+            try:
+                return future.result(timeout)
+            except TimeoutError:
+                pass
+    return engine.latest(session.pk)
+
+
+def handle_batch(session, frames, timeout=1.0, phase=None):
+    """Ingest a batch, score it, add the score to the rollups and analytics and publish it.
+
+    Used by the HTTP samples endpoint. ``phase`` is the current Pomodoro
+    phase, if the client sent one. Raises ``SessionClosed`` like
+    ``ingest_batch``.
+    """
+    result, future, previous = _ingest(session, frames)
+    if future is not None:
+        try:
+            result['attention'] = future.result(timeout)
+        except TimeoutError:
+            pass
+        _scored(session, result['attention'], previous, phase)
+    return result
+
+
+async def handle_batch_async(session, frames, timeout=1.0, phase=None):
+    """``handle_batch`` for the student socket.
+
+    Only the database write runs in a worker thread; the wait for the
+    batched forward pass does not hold it, so sockets of concurrent
+    students can land in the same batch.
+    """
+    result, future, previous = await _db(_ingest)(session, frames)
+    if future is not None:
+        done, _ = await asyncio.wait({asyncio.wrap_future(future)}, timeout=timeout)
+        if done:
+            result['attention'] = done.pop().result()
+            await _db(_scored)(session, result['attention'], previous, phase)
+    return result
+
+
+def _db(func):
+    """Like ``sync_to_async`` but closes stale connections as requests do."""
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+@_db
+def _authenticate(scope):
+    key = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+    if not key:
+        return None
+    try:
+        return CachedTokenAuthentication().authenticate_credentials(key)[0]
+    except AuthenticationFailed:
+        return None
+
+
+@_db
+def _get_session(user, session_id):
+    return AttentionSession.objects.filter(pk=session_id, user=user).first()
+
+
+async def _send_json(send, data):
+    await send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+async def _close(send, code):
+    await send({'type': 'websocket.close', 'code': code})
+
+
+async def session_socket(scope, receive, send, user, session_id):
+    session = await _get_session(user, session_id)
+    if session is None:
+        return await _close(send, 4404)
+    await send({'type': 'websocket.accept'})
+    while True:
+        event = await receive()
+        if event['type'] == 'websocket.disconnect':
+            return
+        phase = None
+        try:
+            if event.get('bytes') is not None:
+                frames = wire.decode(event['bytes'])
+            else:
+                message = json.loads(event.get('text') or '')
+                frames, phase = message['frames'], message.get('phase')
+        except (ValueError, TypeError, KeyError):
+            frames = None
+        if not isinstance(frames, (list, wire.FrameBatch)):
+            await _send_json(send, {'error': 'frames must be a list or a binary frame batch'})
+            continue
+        if phase is not None and phase not in analytics.PHASES:
+            await _send_json(send, {'error': 'Unknown Pomodoro phase'})
+            continue
+        try:
+            result = await handle_batch_async(session, frames, phase=phase)
+        except SessionClosed:
+            await _send_json(send, {'error': 'Session already closed'})
+            return await _close(send, 4409)
+        await _send_json(send, result)
+
+
+async def class_socket(scope, receive, send, user, classroom):
+    if not user.is_staff:
+        return await _close(send, 4403)
+    broker = get_broker()
+    channel = class_channel(classroom)
+    queue = broker.subscribe(channel)
+    await send({'type': 'websocket.accept'})
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({message, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                message.cancel()
+                return
+            await _send_json(send, message.result())
+    finally:
+        disconnect.cancel()
+        broker.unsubscribe(channel, queue)
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
+
+
+ROUTES = [
+    (re.compile(r'^/ws/sessions/(?P<session_id>\d+)/$'), session_socket),
+    (re.compile(r'^/ws/classes/(?P<classroom>[\w-]+)/$'), class_socket),
+]
+
+
+async def websocket_application(scope, receive, send):
+    """ASGI application for the ``websocket`` scope type."""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    for pattern, handler in ROUTES:
+        match = pattern.match(scope['path'])
+        if match:
+            break
+    else:
+        return await _close(send, 4404)
+    user = await _authenticate(scope)
+    if user is None:
+        return await _close(send, 4401)
+    await handler(scope, receive, send, user, **match.groupdict())
@@ -0,0 +1,252 @@
+"""Incrementally maintained attention rollups and the reports built on them.
+
+Every score produced for a session is added to one ``AttentionRollup``
+row per scope (student, course, class, global) and granularity (minute,
+hour, day, week), plus a daily row of the student in the class, with a
+single upsert. Reports only read these rows; the
+``rebuild_rollups`` command recomputes them from the raw samples.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import samplestore
+from .inference import attention_level
+from .models import AttentionRollup, AttentionSession, SamplePartition
+
+GRANULARITIES = ('minute', 'hour', 'day', 'week')
+GLOBAL_KEY = 'all'
+LEVELS = ('low', 'medium', 'high')
+# Parts of the day used by the weekday heatmap, as [start, end) hours
+PERIODS = (('morning', 5, 12), ('afternoon', 12, 18), ('evening', 18, 24))
+
+_COUNTERS = ('count', 'score_sum', 'low_count', 'medium_count', 'high_count')
+
+
+def bucket_start(dt, granularity):
+    """Start of the local-time bucket containing ``dt``; weeks start on Monday."""
+    dt = timezone.localtime(dt)
+    if granularity == 'minute':
+        return dt.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+def member_key(classroom, user_id):
+    return f'{classroom}:{user_id}'
+
+
+def session_keys(session):
+    keys = [(AttentionRollup.SCOPE_STUDENT, str(session.user_id)), (AttentionRollup.SCOPE_GLOBAL, GLOBAL_KEY)]
+    if session.course:
+        keys.append((AttentionRollup.SCOPE_COURSE, session.course))
+    if session.classroom:
+        keys.append((AttentionRollup.SCOPE_CLASS, session.classroom))
+        keys.append((AttentionRollup.SCOPE_MEMBER, member_key(session.classroom, session.user_id)))
+    return keys
+
+
+def aggregate(session, observations, into=None):
+    """Fold ``(datetime, score)`` observations into per-bucket counters."""
+    rows = defaultdict(lambda: [0, 0.0, 0, 0, 0]) if into is None else into
+    keys = session_keys(session)
+    for dt, score in observations:
+        level = 2 + LEVELS.index(attention_level(score))
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(dt, granularity)
+            for scope, key in keys:
+                if scope == AttentionRollup.SCOPE_MEMBER and granularity != 'day':
+                    # Only the class comparison of student reports reads these.
+                    continue
+                counters = rows[scope, key, granularity, bucket]
+                counters[0] += 1
+                counters[1] += score
+                counters[level] += 1
+    return rows
+
+
+def record_scores(session, observations):
+    """Add scores of a session to its rollups in one statement."""
+    rows = aggregate(session, observations)
+    if rows:
+        _upsert(rows)
+
+
+def _upsert(rows):
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return _upsert_orm(rows)
+    qn = connection.ops.quote_name
+    table = qn(AttentionRollup._meta.db_table)
+    columns = ('scope', 'key', 'granularity', 'bucket') + _COUNTERS
+    placeholders = '(%s)' % ', '.join(['%s'] * len(columns))
+    params = []
+    for (scope, key, granularity, bucket), counters in rows.items():
+        params.extend([scope, key, granularity, connection.ops.adapt_datetimefield_value(bucket), *counters])
+    sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO UPDATE SET %s' % (
+        table,
+        ', '.join(qn(c) for c in columns),
+        ', '.join([placeholders] * len(rows)),
+        ', '.join(qn(c) for c in columns[:4]),
+        ', '.join('%s = %s.%s + excluded.%s' % (qn(c), table, qn(c), qn(c)) for c in _COUNTERS),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _upsert_orm(rows):
+    with transaction.atomic():
+        for (scope, key, granularity, bucket), counters in rows.items():
+            increments = {c: F(c) + v for c, v in zip(_COUNTERS, counters)}
+            lookup = dict(scope=scope, key=key, granularity=granularity, bucket=bucket)
+            if not AttentionRollup.objects.filter(**lookup).update(**increments):
+                AttentionRollup.objects.create(**lookup, **dict(zip(_COUNTERS, counters)))
+
+
+def has_rollups(session):
+    """Whether scores of ``session`` may already be in the rollups.
+
+    Rollups do not record the sessions they came from, so this looks for
+    minute buckets of the student during the session.
+    """
+    times = [session.started_at, session.ended_at or timezone.now()]
+    times += [datetime.fromtimestamp(ts / 1000.0, tz=dt_timezone.utc)
+              for ts in (session.first_ts, session.last_ts) if ts is not None]
+    return AttentionRollup.objects.filter(
+        scope=AttentionRollup.SCOPE_STUDENT, key=str(session.user_id), granularity='minute',
+        bucket__gte=bucket_start(min(times), 'minute'), bucket__lte=max(times),
+    ).exists()
+
+
+def score_session(session, model, window, step, batch_size=256):
+    """Replay a session's stored frames through the model.
+
+    Scores every ``step``-th full window, as the live path does roughly
+    once per batch. Yields ``(datetime, score)`` pairs.
+    """
+    ts, feats = samplestore.session_arrays(session)
+    if len(ts) < window:
+        return
+    windows = np.lib.stride_tricks.sliding_window_view(feats, (window, session.feature_count))[::step, 0]
+    ends = ts[window - 1::step]
+    for start in range(0, len(windows), batch_size):
+        probs = model.forward(windows[start:start + batch_size])
+        for t, prob in zip(ends[start:start + batch_size], probs):
+            dt = datetime.fromtimestamp(t / 1000.0, tz=dt_timezone.utc)
+            yield dt, round(float(prob) * 100, 1)
+
+
+def rebuild(model, window, step, sessions=None):
+    """Recompute rollups from raw samples.
+
+    Without ``sessions`` the rollups are replaced; otherwise the scores of
+    the given sessions are added to the existing rollups (a backfill).
+    Raw frames older than ``SAMPLE_RAW_RETENTION_DAYS`` have been compacted
+    away, so a full rebuild keeps the buckets that start before the oldest
+    remaining partition, and does nothing when there is none.
+    Returns the number of rollup rows written.
+    """
+    rows = defaultdict(lambda: [0, 0.0, 0, 0, 0])
+    for session in (AttentionSession.objects.all() if sessions is None else sessions).iterator():
+        aggregate(session, score_session(session, model, window, step), into=rows)
+    if sessions is not None:
+        items = list(rows.items())
+        for start in range(0, len(items), 200):
+            _upsert(dict(items[start:start + 200]))
+        return len(items)
+    oldest = SamplePartition.objects.aggregate(oldest=Min('week_start'))['oldest']
+    if oldest is None:
+        return 0
+    cutoff = datetime.fromtimestamp(oldest / 1000, tz=dt_timezone.utc)
+    objs = [
+        AttentionRollup(scope=scope, key=key, granularity=granularity, bucket=bucket, **dict(zip(_COUNTERS, counters)))
+        for (scope, key, granularity, bucket), counters in rows.items() if bucket >= cutoff
+    ]
+    with transaction.atomic():
+        AttentionRollup.objects.filter(bucket__gte=cutoff).delete()
+        AttentionRollup.objects.bulk_create(objs, batch_size=500)
+    return len(objs)
+
+
+def _summary(counters):
+    count = counters['count']
+    return {
+        'score': round(counters['score_sum'] / count, 1) if count else None,
+        'samples': count,
+        **{level: counters[f'{level}_count'] for level in LEVELS},
+    }
+
+
+def series(scope, key, granularity, since, until=None):
+    """Rollup buckets of one scope and key in ``[since, until)``, oldest first."""
+    qs = AttentionRollup.objects.filter(scope=scope, key=key, granularity=granularity, bucket__gte=since)
+    if until is not None:
+        qs = qs.filter(bucket__lt=until)
+    return [
+        {'bucket': row['bucket'], **_summary(row)}
+        for row in qs.order_by('bucket').values('bucket', *_COUNTERS)
+    ]
+
+
+def _merge(buckets, group):
+    totals = defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+    for row in buckets:
+        name = group(timezone.localtime(row['bucket']))
+        if name is None:
+            continue
+        for c in _COUNTERS:
+            totals[name][c] += row[c]
+    return totals
+
+
+def _period(dt):
+    for name, start, end in PERIODS:
+        if start <= dt.hour < end:
+            return name
+    return None
+
+
+def student_report(user_id, since, classrooms=()):
+    """Daily timeline, hour-of-day profile, weekday heatmap and class comparison."""
+    key = str(user_id)
+    hours = list(AttentionRollup.objects.filter(
+        scope=AttentionRollup.SCOPE_STUDENT, key=key, granularity='hour', bucket__gte=since,
+    ).values('bucket', *_COUNTERS))
+    by_hour = _merge(hours, lambda dt: dt.hour)
+    heatmap = _merge(hours, lambda dt: (dt.weekday(), _period(dt)) if _period(dt) else None)
+
+    comparison = []
+    for classroom in classrooms:
+        # The student's scores in this class against the whole class's, on
+        # the days the student had scores there.
+        own = list(AttentionRollup.objects.filter(
+            scope=AttentionRollup.SCOPE_MEMBER, key=member_key(classroom, user_id), granularity='day',
+            bucket__gte=since,
+        ).values('bucket', *_COUNTERS))
+        rows = AttentionRollup.objects.filter(
+            scope=AttentionRollup.SCOPE_CLASS, key=classroom, granularity='day', bucket__in=[r['bucket'] for r in own],
+        ).values('bucket', *_COUNTERS)
+        student_totals = _merge(own, lambda dt: 'all').get('all')
+        class_totals = _merge(rows, lambda dt: 'all').get('all')
+        comparison.append({
+            'classroom': classroom,
+            'student': _summary(student_totals)['score'] if student_totals else None,
+            'class': _summary(class_totals)['score'] if class_totals else None,
+        })
+
+    return {
+        'timeline': series(AttentionRollup.SCOPE_STUDENT, key, 'day', since),
+        'by_hour': [{'hour': h, **_summary(by_hour[h])} for h in sorted(by_hour)],
+        'heatmap': [
+            {'weekday': weekday, 'period': period, **_summary(heatmap[weekday, period])}
+            for weekday in range(7) for period, _, _ in PERIODS if (weekday, period) in heatmap
+        ],
+        'comparison': comparison,
+    }
@@ -0,0 +1,36 @@
+"""Database routing of the time-series sample data.
+
+``SamplePartition``, ``SampleAggregate`` and the per-week ``SampleChunk``
+tables go to the ``SAMPLES_DATABASE`` alias, so frame ingestion does not
+share a database (and, on SQLite, a write lock) with users, tokens and
+messages. Without that alias everything stays on the default database.
+"""
+from django.conf import settings
+
+SAMPLE_MODELS = {'samplepartition', 'sampleaggregate'}
+
+
+def samples_database():
+    alias = getattr(settings, 'SAMPLES_DATABASE', 'samples')
+    return alias if alias in settings.DATABASES else None
+
+
+class SampleRouter:
+    def _route(self, model):
+        from .models import SampleChunk
+
+        if model._meta.model_name in SAMPLE_MODELS or issubclass(model, SampleChunk):
+            return samples_database()
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        samples = samples_database()
+        if samples is None:
+            return None
+        return (app_label == 'api' and model_name in SAMPLE_MODELS) == (db == samples)
@@ -0,0 +1,298 @@
+"""Time-partitioned storage of the raw sample chunks.
+
+Chunks are written to one table per course and week (weeks start on
+Monday, UTC) in the samples database (see ``api.routers``). Tables are
+created on first use and listed in ``SamplePartition``. Chunks never span
+two weeks, so a range query only reads the partitions of the weeks it
+overlaps. Expired partitions are downsampled to ``SampleAggregate`` rows
+and dropped as a whole by ``compact_samples``, without any row-by-row
+delete.
+
+Chunks are written in a transaction of the samples database (see
+``api.ingestion``); the session counters are updated in the default
+database just before it commits. If that commit fails, the chunks the
+counters include are missing. Readers ignore chunks whose ``seq`` is past
+``session.chunk_count``. A chunk is never overwritten by a concurrent
+batch: the second insert of a ``seq`` fails.
+"""
+import hashlib
+import re
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.apps.registry import Apps
+from django.db import DatabaseError, IntegrityError, connections, router, transaction
+
+from .models import SampleAggregate, SampleChunk, SamplePartition
+
+WEEK_MS = 7 * 24 * 3600 * 1000
+# 1970-01-05, the first Monday after the epoch
+EPOCH_MONDAY_MS = 4 * 24 * 3600 * 1000
+
+# Partition models are kept out of the project's app registry.
+_apps = Apps()
+_models = {}
+# Tables this process has created or seen in the catalog
+_known = set()
+
+
+def database():
+    return router.db_for_write(SamplePartition)
+
+
+def week_start(ts):
+    """Start (ms since the epoch) of the week containing ``ts``."""
+    return EPOCH_MONDAY_MS + (ts - EPOCH_MONDAY_MS) // WEEK_MS * WEEK_MS
+
+
+def table_name(course, week):
+    slug = re.sub(r'[^a-z0-9]+', '_', course.lower()).strip('_')[:24] or 'none'
+    digest = hashlib.sha1(course.encode()).hexdigest()[:6]
+    day = datetime.fromtimestamp(week / 1000, tz=dt_timezone.utc)
+    return f'samples_{slug}_{digest}_{day:%Y%m%d}'
+
+
+def partition_model(table):
+    """The ``SampleChunk`` model of one partition table."""
+    model = _models.get(table)
+    if model is None:
+        meta = type('Meta', (SampleChunk.Meta,), {'db_table': table, 'app_label': 'api', 'apps': _apps})
+        model = _models[table] = type(table, (SampleChunk,), {'__module__': __name__, 'Meta': meta})
+    return model
+
+
+def _create_table(model):
+    # A plain CREATE TABLE: SQLite's schema editor refuses to run inside the
+    # transactions chunks are written in.
+    connection = connections[database()]
+    editor = connection.schema_editor()
+    sql, params = editor.table_sql(model)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params or None)
+        for index in model._meta.indexes:
+            cursor.execute(str(index.create_sql(model, editor)))
+
+
+def ensure_partition(course, week):
+    """Return the model of the partition of ``course`` and ``week``, creating it if needed."""
+    table = table_name(course, week)
+    if table not in _known:
+        with transaction.atomic(using=database()):
+            _, created = SamplePartition.objects.get_or_create(
+                course=course, week_start=week, defaults={'table': table, 'week_end': week + WEEK_MS})
+            if created:
+                _create_table(partition_model(table))
+        _known.add(table)
+    return partition_model(table)
+
+
+def split_chunks(timestamps, features, size):
+    """Yield ``(week, timestamps, features)`` runs of at most ``size`` frames within one week."""
+    weeks = week_start(timestamps)
+    bounds = np.flatnonzero(np.diff(weeks)) + 1
+    for ts, feats, week in zip(np.split(timestamps, bounds), np.split(features, bounds), weeks[np.r_[0, bounds]]):
+        for start in range(0, len(ts), size):
+            yield float(week), ts[start:start + size], feats[start:start + size]
+
+
+def write_chunks(session, timestamps, features, size, overwrite=False):
+    """Store sorted frames of ``session`` from ``seq = session.chunk_count`` on.
+
+    Raises ``IntegrityError`` if one of these ``seq`` is taken, unless
+    ``overwrite`` is set. Returns the number of chunks written.
+    """
+    by_week = {}
+    seq = session.chunk_count
+    for week, ts, feats in split_chunks(timestamps, features, size):
+        by_week.setdefault(week, []).append(dict(
+            session_id=session.pk,
+            seq=seq,
+            start_ts=float(ts[0]),
+            end_ts=float(ts[-1]),
+            frame_count=len(ts),
+            timestamps=ts.astype('<f8').tobytes(),
+            features=feats.astype('<f4').tobytes(),
+        ))
+        seq += 1
+    for week, rows in by_week.items():
+        _write(session.course, week, rows, overwrite)
+    return seq - session.chunk_count
+
+
+def _write(course, week, rows, overwrite=False):
+    for attempt in range(2):
+        model = ensure_partition(course, week)
+        try:
+            with transaction.atomic(using=database()):
+                if overwrite:
+                    model.objects.bulk_create(
+                        [model(**row) for row in rows], update_conflicts=True, unique_fields=['session_id', 'seq'],
+                        update_fields=['start_ts', 'end_ts', 'frame_count', 'timestamps', 'features'])
+                else:
+                    model.objects.bulk_create([model(**row) for row in rows])
+            return
+        except IntegrityError:
+            raise
+        except DatabaseError:
+            # The table may have been dropped since it was cached.
+            if attempt:
+                raise
+            _known.discard(table_name(course, week))
+
+
+def partitions(session, start=None, end=None):
+    """Catalog entries of the partitions holding the frames of ``session`` in ``[start, end]``."""
+    if session.first_ts is None:
+        return []
+    start = session.first_ts if start is None else max(start, session.first_ts)
+    end = session.last_ts if end is None else min(end, session.last_ts)
+    return list(SamplePartition.objects.filter(
+        course=session.course, week_start__lte=end, week_end__gt=start,
+    ).order_by('week_start'))
+
+
+def session_chunks(session, start=None, end=None):
+    """Chunks of ``session`` overlapping ``[start, end]`` (ms), in order.
+
+    Only the partitions of the weeks in the range are read.
+    """
+    chunks = []
+    for partition in partitions(session, start, end):
+        qs = partition_model(partition.table).objects.filter(session_id=session.pk, seq__lt=session.chunk_count)
+        if start is not None:
+            qs = qs.filter(end_ts__gte=start)
+        if end is not None:
+            qs = qs.filter(start_ts__lte=end)
+        chunks.extend(qs.order_by('seq'))
+    return chunks
+
+
+def session_arrays(session, start=None, end=None):
+    """``(timestamps, features)`` arrays of the frames of ``session`` in ``[start, end]``."""
+    chunks = session_chunks(session, start, end)
+    if not chunks:
+        return np.empty(0), np.empty((0, session.feature_count), dtype=np.float32)
+    ts = np.concatenate([np.frombuffer(bytes(c.timestamps), dtype='<f8') for c in chunks])
+    feats = np.concatenate([np.frombuffer(bytes(c.features), dtype='<f4') for c in chunks])
+    feats = feats.reshape(-1, session.feature_count)
+    keep = np.ones(len(ts), dtype=bool)
+    if start is not None:
+        keep &= ts >= start
+    if end is not None:
+        keep &= ts <= end
+    return ts[keep], feats[keep]
+
+
+def last_features(session, count):
+    """The features of the latest ``count`` frames of ``session``, oldest first."""
+    parts, total = [], 0
+    for partition in reversed(partitions(session)):
+        qs = partition_model(partition.table).objects.filter(session_id=session.pk, seq__lt=session.chunk_count)
+        # Every chunk holds at least one frame.
+        for chunk in qs.order_by('-seq')[:count - total]:
+            parts.append(np.frombuffer(bytes(chunk.features), dtype='<f4').reshape(-1, session.feature_count))
+            total += len(parts[-1])
+            if total >= count:
+                break
+        if total >= count:
+            break
+    if not parts:
+        return np.empty((0, session.feature_count), dtype=np.float32)
+    return np.concatenate(parts[::-1])[-count:]
+
+
+def delete_session(session):
+    """Delete the chunks and aggregates of a session."""
+    for partition in partitions(session):
+        try:
+            with transaction.atomic(using=database()):
+                partition_model(partition.table).objects.filter(session_id=session.pk).delete()
+        except DatabaseError:
+            _known.discard(partition.table)
+    SampleAggregate.objects.filter(session_id=session.pk).delete()
+
+
+def downsample(chunks, feature_counts, seconds, origin=0):
+    """``SampleAggregate`` rows of ``chunks``, one per session and bucket of ``seconds``.
+
+    Buckets are aligned to ``origin`` (ms), the start of the partition, so
+    none crosses into the next one. ``feature_counts`` maps session ids to
+    their feature count; chunks of other sessions are skipped.
+    """
+    frames = {}
+    for chunk in chunks:
+        count = feature_counts.get(chunk.session_id)
+        if count is None:
+            continue
+        ts = np.frombuffer(bytes(chunk.timestamps), dtype='<f8')
+        feats = np.frombuffer(bytes(chunk.features), dtype='<f4').reshape(-1, count)
+        frames.setdefault(chunk.session_id, []).append((ts, feats))
+
+    width = seconds * 1000.0
+    rows = []
+    for session_id, parts in frames.items():
+        ts = np.concatenate([p[0] for p in parts])
+        feats = np.concatenate([p[1] for p in parts]).astype(np.float64)
+        buckets = origin + np.floor((ts - origin) / width) * width
+        starts, index, counts = np.unique(buckets, return_inverse=True, return_counts=True)
+        sums = np.zeros((len(starts), feats.shape[1]))
+        squares = np.zeros_like(sums)
+        np.add.at(sums, index, feats)
+        np.add.at(squares, index, feats ** 2)
+        mean = sums / counts[:, None]
+        std = np.sqrt(np.maximum(squares / counts[:, None] - mean ** 2, 0))
+        rows.extend(
+            SampleAggregate(session_id=session_id, start_ts=float(start), seconds=seconds, frame_count=int(n),
+                            mean=m.astype('<f4').tobytes(), std=s.astype('<f4').tobytes())
+            for start, n, m, s in zip(starts, counts, mean, std)
+        )
+    return rows
+
+
+def _merge_aggregates(rows):
+    """Add to ``rows`` the aggregates already stored for the same buckets."""
+    stored = {
+        (a.session_id, a.start_ts): a
+        for a in SampleAggregate.objects.filter(session_id__in={r.session_id for r in rows},
+                                                start_ts__in={r.start_ts for r in rows})
+    }
+    for row in rows:
+        old = stored.get((row.session_id, row.start_ts))
+        if old is None:
+            continue
+        n1, n2 = old.frame_count, row.frame_count
+        m1, m2 = (np.frombuffer(bytes(a.mean), dtype='<f4').astype(np.float64) for a in (old, row))
+        s1, s2 = (np.frombuffer(bytes(a.std), dtype='<f4').astype(np.float64) for a in (old, row))
+        mean = (n1 * m1 + n2 * m2) / (n1 + n2)
+        std = np.sqrt(np.maximum((n1 * (s1 ** 2 + m1 ** 2) + n2 * (s2 ** 2 + m2 ** 2)) / (n1 + n2) - mean ** 2, 0))
+        row.frame_count = n1 + n2
+        row.seconds = max(row.seconds, old.seconds)
+        row.mean, row.std = mean.astype('<f4').tobytes(), std.astype('<f4').tobytes()
+    return rows
+
+
+def drop_partition(partition, feature_counts, seconds):
+    """Downsample a partition into ``SampleAggregate`` rows and drop its table.
+
+    Returns the number of aggregate rows written.
+    """
+    model = partition_model(partition.table)
+    connection = connections[database()]
+    with transaction.atomic(using=database()):
+        try:
+            with transaction.atomic(using=database()):
+                chunks = list(model.objects.all())
+        except DatabaseError:
+            # The table is already gone; only the catalog entry is left.
+            chunks = None
+        rows = [] if chunks is None else _merge_aggregates(
+            downsample(chunks, feature_counts, seconds, partition.week_start))
+        SampleAggregate.objects.bulk_create(
+            rows, batch_size=500, update_conflicts=True, unique_fields=['session_id', 'start_ts'],
+            update_fields=['seconds', 'frame_count', 'mean', 'std'])
+        if chunks is not None:
+            with connection.cursor() as cursor:
+                cursor.execute('DROP TABLE %s' % connection.ops.quote_name(partition.table))
+        partition.delete()
+    _known.discard(partition.table)
+    return len(rows)
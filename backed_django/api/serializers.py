@@ -1,7 +1,69 @@
+from django.core import signing
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Message
+from .ingestion import MAX_FEATURE_COUNT
+from .materials import MAX_UPLOAD_SIZE
+from .models import Message, AttentionSession, CourseMaterial, MaterialUpload, ProvisioningJob, SessionSummary
+from .provisioning import summarize
 
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = '__all__'
+
+
+class AttentionSessionSerializer(serializers.ModelSerializer):
+    feature_count = serializers.IntegerField(min_value=1, max_value=MAX_FEATURE_COUNT)
+
+    class Meta:
+        model = AttentionSession
+        fields = ['id', 'course', 'classroom', 'feature_count', 'started_at', 'ended_at', 'frame_count']
+        read_only_fields = ['started_at', 'ended_at', 'frame_count']
+
+
+class SessionSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SessionSummary
+        fields = ['samples', 'mean_score', 'std_score', 'seconds', 'distraction_episodes', 'distracted_seconds',
+                  'phases', 'episodes', 'created_at']
+
+
+class CourseMaterialSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CourseMaterial
+        fields = ['id', 'course', 'title', 'kind', 'content_type', 'size', 'sha256', 'duration', 'page_count',
+                  'created_at', 'download_url']
+
+    def get_download_url(self, obj):
+        # Signed so <video>/<iframe> elements, which cannot send the token
+        # header, can fetch it; see CourseMaterialViewSet.download.
+        url = reverse('material-download', args=[obj.pk])
+        url += '?sig=' + signing.TimestampSigner(salt='material-download').sign(str(obj.pk))
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
+class MaterialUploadSerializer(serializers.ModelSerializer):
+    # Also names the directory of the stored file
+    course = serializers.RegexField(r'^[\w-]+$', max_length=64)
+    size = serializers.IntegerField(min_value=1, max_value=MAX_UPLOAD_SIZE)
+    material = CourseMaterialSerializer(read_only=True)
+
+    class Meta:
+        model = MaterialUpload
+        fields = ['id', 'course', 'title', 'filename', 'size', 'sha256', 'received', 'material']
+        read_only_fields = ['received']
+
+
+class ProvisioningJobSerializer(serializers.ModelSerializer):
+    summary = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProvisioningJob
+        fields = ['id', 'status', 'total', 'summary', 'report', 'error', 'created_at', 'finished_at']
+        read_only_fields = fields
+
+    def get_summary(self, obj):
+        return summarize(obj.report)
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import samplestore
+from .authentication import token_cache
+from .models import AttentionSession
+from .routers import samples_database
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def forget_user_tokens(sender, instance, **kwargs):
+    # Covers password changes and deactivation.
+    token_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=AttentionSession)
+def delete_session_samples(sender, instance, **kwargs):
+    # Samples live in another database, out of reach of the cascade.
+    samplestore.delete_session(instance)
+
+
+@receiver(connection_created)
+def configure_sample_store(sender, connection, **kwargs):
+    # WAL lets readers run while a batch is being written.
+    if connection.vendor == 'sqlite' and connection.alias == samples_database():
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
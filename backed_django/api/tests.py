@@ -1,3 +1,978 @@
-from django.test import TestCase
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import resolve
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import analytics, inference, materials, metrics, modelstore, provisioning, realtime, rollups, samplestore, wire
+from .authentication import TokenCache, token_cache
+from .inference import InferenceEngine, NumpyLSTM
+from .ingestion import chunk_arrays, chunk_frames, frames_from_json, ingest_batch
+from .materials import parse_range, pdf_page_count
+from .models import (
+    AttentionRollup, AttentionSession, CourseMaterial, MaterialUpload, Message, ProvisioningJob, SampleAggregate,
+    SamplePartition, SessionSummary,
+)
+from .realtime import InProcessBroker, websocket_application
+
+User = get_user_model()
+
+
+def make_frames(start, count, width=3):
+    return [{'t': start + i * 100, 'features': [i / 10] * width} for i in range(count)]
+
+
+def read_json(response):
+    return json.loads(b''.join(response.streaming_content))
+
+
+class SampleIngestionTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', email='ana@example.com', password='secret-pass-1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/sessions/', {'feature_count': 3, 'course': 'math'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.session_id = response.data['id']
+
+    def post_frames(self, frames):
+        return self.client.post(f'/api/sessions/{self.session_id}/samples/', {'frames': frames}, format='json')
+
+    def test_taken_seq_is_not_overwritten(self):
+        session = AttentionSession.objects.get(pk=self.session_id)
+        ts, feats = frames_from_json(make_frames(0, 5), 3)
+        samplestore.write_chunks(session, ts, feats, 256)
+        with self.assertRaises(IntegrityError), transaction.atomic(using='samples'):
+            samplestore.write_chunks(session, ts + 1000, feats, 256)
+
+        # The chunk was never counted, as after a lost counter update, so a
+        # batch with chunk_count unchanged replaces it.
+        self.assertEqual(ingest_batch(self.session_id, make_frames(5000, 4))[0]['accepted'], 4)
+        session.refresh_from_db()
+        stored, _ = samplestore.session_arrays(session)
+        np.testing.assert_array_equal(stored, 5000 + np.arange(4) * 100)
+
+    def test_batch_is_stored_packed(self):
+        response = self.post_frames(make_frames(1000, 300))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'accepted': 300, 'dropped': 0, 'frame_count': 300})
+        chunks = samplestore.session_chunks(AttentionSession.objects.get(pk=self.session_id))
+        self.assertEqual([c.frame_count for c in chunks], [256, 44])
+        t, feats = list(chunk_frames(chunks[1], 3))[-1]
+        self.assertEqual(t, 1000 + 299 * 100)
+        self.assertAlmostEqual(feats[0], 29.9, places=4)
+
+    def test_invalid_and_stale_frames_are_dropped(self):
+        self.post_frames(make_frames(1000, 5))
+        frames = make_frames(1000, 10) + [{'t': 'x', 'features': [1, 2, 3]}, {'t': 99999, 'features': [1, 2]}]
+        response = self.post_frames(frames)
+        self.assertEqual(response.data['accepted'], 5)
+        self.assertEqual(response.data['dropped'], 7)
+        session = AttentionSession.objects.get(pk=self.session_id)
+        self.assertEqual((session.frame_count, session.chunk_count), (10, 2))
+
+    def test_non_object_body_is_rejected(self):
+        response = self.client.post(f'/api/sessions/{self.session_id}/samples/', make_frames(1000, 2), format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_closed_session_rejects_frames(self):
+        self.client.post(f'/api/sessions/{self.session_id}/close/')
+        self.assertEqual(self.post_frames(make_frames(1000, 1)).status_code, 409)
+
+    def test_sessions_are_private(self):
+        other = User.objects.create_user(username='beto', email='beto@example.com', password='secret-pass-2')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.post_frames(make_frames(1000, 1)).status_code, 404)
+
+
+def random_lstm(feature_count=3, units=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return NumpyLSTM(
+        rng.normal(size=(feature_count, 4 * units)), rng.normal(size=(units, 4 * units)),
+        rng.normal(size=4 * units), rng.normal(size=(units, 1)), rng.normal(size=1),
+    )
+
+
+class InferenceEngineTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def test_batched_forward_matches_single(self):
+        model = random_lstm()
+        x = np.random.default_rng(1).normal(size=(5, 10, 3)).astype(np.float32)
+        batched = model.forward(x)
+        single = [model.forward(x[i:i + 1])[0] for i in range(5)]
+        np.testing.assert_allclose(batched, single, rtol=1e-5)
+
+    def test_weights_round_trip(self):
+        model = random_lstm()
+        x = np.ones((1, 4, 3), dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            model.save(path)
+            np.testing.assert_allclose(NumpyLSTM.load(path).forward(x), model.forward(x))
+
+    def test_window_keeps_latest_frames_in_order(self):
+        engine = InferenceEngine(random_lstm(), window=4)
+        self.assertFalse(engine.observe('a', np.arange(9).reshape(3, 3)))
+        self.assertTrue(engine.observe('a', np.arange(9, 18).reshape(3, 3)))
+        np.testing.assert_array_equal(engine._windows['a'].snapshot()[:, 0], [6, 9, 12, 15])
+
+    def test_concurrent_sessions_share_a_batch(self):
+        model = random_lstm()
+        calls = []
+        forward = model.forward
+        model.forward = lambda x: calls.append(len(x)) or forward(x)
+        engine = InferenceEngine(model, window=5, max_batch_size=3, max_wait_ms=200)
+        rng = np.random.default_rng(2)
+        windows = {s: rng.normal(size=(5, 3)).astype(np.float32) for s in range(3)}
+        futures = []
+        for s, frames in windows.items():
+            engine.observe(s, frames)
+            futures.append(engine.submit(s))
+        results = [f.result(2) for f in futures]
+        self.assertEqual(calls, [3])
+        for s, result in zip(windows, results):
+            expected = forward(windows[s][None])[0] * 100
+            self.assertAlmostEqual(result['score'], round(float(expected), 1), places=1)
+            self.assertEqual(engine.latest(s), result)
+
+    def test_window_is_reseeded_from_batches_of_other_workers(self):
+        user = User.objects.create_user(username='cata', email='cata@example.com', password='x')
+        session = AttentionSession.objects.create(user=user, feature_count=3)
+        engine = inference._engine = InferenceEngine(random_lstm(), window=6, max_wait_ms=1)
+        try:
+            realtime.handle_batch(session, make_frames(0, 4))
+            # A batch ingested by another worker never reaches this engine.
+            ingest_batch(session.pk, make_frames(400, 4))
+            realtime.handle_batch(session, make_frames(800, 4))
+            window = engine._windows[session.pk]
+            self.assertEqual(window.position, 12)
+            np.testing.assert_allclose(window.snapshot()[:, 0], [0.2, 0.3, 0, 0.1, 0.2, 0.3], atol=1e-6)
+
+            ingest_batch(session.pk, make_frames(1200, 2))
+            session.refresh_from_db()
+            self.assertIsNotNone(realtime.latest_attention(session))
+            self.assertEqual(engine.position(session.pk), 14)
+        finally:
+            inference._engine = None
+
+    def test_ingestion_returns_attention(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            random_lstm().save(path)
+            inference._engine = None
+            try:
+                with override_settings(ATTENTION_MODEL_PATH=path, ATTENTION_WINDOW=10):
+                    user = User.objects.create_user(username='caro', email='caro@example.com', password='secret-pass-3')
+                    client = APIClient()
+                    client.force_authenticate(user)
+                    session_id = client.post('/api/sessions/', {'feature_count': 3}, format='json').data['id']
+                    url = f'/api/sessions/{session_id}/samples/'
+                    first = client.post(url, {'frames': make_frames(0, 5)}, format='json')
+                    self.assertIsNone(first.data['attention'])
+                    second = client.post(url, {'frames': make_frames(1000, 5)}, format='json')
+                    self.assertIn(second.data['attention']['label'], ('attention', 'distraction'))
+                    latest = client.get(f'/api/sessions/{session_id}/attention/')
+                    self.assertEqual(latest.data['attention'], second.data['attention'])
+            finally:
+                inference._engine = None
+
+
+class RealtimeTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.student = User.objects.create_user(username='dani', email='dani@example.com', password='secret-pass-4')
+        self.teacher = User.objects.create_user(username='eva', email='eva@example.com', password='secret-pass-5', is_staff=True)
+        self.session = AttentionSession.objects.create(user=self.student, feature_count=3, classroom='5a')
+        self.tokens = {user: Token.objects.create(user=user).key for user in (self.student, self.teacher)}
+        self.engine = InferenceEngine(random_lstm(), window=5, max_wait_ms=1)
+        inference._engine = self.engine
+
+    def tearDown(self):
+        inference._engine = None
+
+    def connect(self, path, user):
+        scope = {'type': 'websocket', 'path': path, 'query_string': f'token={self.tokens.get(user, "")}'.encode()}
+        return ApplicationCommunicator(websocket_application, scope)
+
+    async def test_rejects_anonymous_and_non_staff(self):
+        for path, user in [('/ws/classes/5a/', None), ('/ws/classes/5a/', self.student)]:
+            socket = self.connect(path, user)
+            await socket.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await socket.receive_output(1))['type'], 'websocket.close')
+
+    async def test_student_scores_reach_class_feed(self):
+        self.engine.model.forward = lambda x: np.full(len(x), 0.1)
+        teacher = self.connect('/ws/classes/5a/', self.teacher)
+        await teacher.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await teacher.receive_output(1))['type'], 'websocket.accept')
+
+        student = self.connect(f'/ws/sessions/{self.session.pk}/', self.student)
+        await student.send_input({'type': 'websocket.connect'})
+        self.assertEqual((await student.receive_output(1))['type'], 'websocket.accept')
+        await student.send_input({'type': 'websocket.receive', 'text': json.dumps({'frames': make_frames(0, 5)})})
+        reply = json.loads((await student.receive_output(2))['text'])
+        self.assertEqual(reply['accepted'], 5)
+        self.assertEqual(reply['attention']['level'], 'low')
+
+        messages = [json.loads((await teacher.receive_output(1))['text']) for _ in range(2)]
+        self.assertEqual([m['type'] for m in messages], ['attention', 'low_attention'])
+        self.assertEqual(messages[0]['student'], self.student.pk)
+        await student.send_input({'type': 'websocket.disconnect'})
+        await teacher.send_input({'type': 'websocket.disconnect'})
+        await teacher.wait(1)
+        await sync_to_async(self.session.refresh_from_db)()
+        stored = await sync_to_async(samplestore.session_chunks)(self.session)
+        self.assertEqual(len(stored), 1)
+
+    def test_broker_drops_oldest_for_slow_subscribers(self):
+        async def run():
+            broker = InProcessBroker(queue_size=2)
+            queue = broker.subscribe('c')
+            for i in range(3):
+                broker.publish('c', i)
+            await asyncio.sleep(0)
+            items = [queue.get_nowait() for _ in range(queue.qsize())]
+            broker.unsubscribe('c', queue)
+            return items, broker._channels
+        self.assertEqual(asyncio.run(run()), ([1, 2], {}))
+
+
+class RollupTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='fer', email='fer@example.com', password='secret-pass-6')
+        self.session = AttentionSession.objects.create(user=self.user, feature_count=3, course='math', classroom='5a')
+        # A Tuesday, 09:15 UTC
+        self.when = datetime(2026, 3, 10, 9, 15, tzinfo=dt_timezone.utc)
+
+    def rollup(self, scope, key, granularity):
+        return AttentionRollup.objects.get(scope=scope, key=key, granularity=granularity)
+
+    def test_scores_accumulate_in_every_bucket(self):
+        rollups.record_scores(self.session, [(self.when, 80.0), (self.when, 30.0)])
+        rollups.record_scores(self.session, [(self.when, 50.0)])
+        self.assertEqual(AttentionRollup.objects.count(), 4 * 4 + 1)
+        week = self.rollup('class', '5a', 'week')
+        self.assertEqual(week.bucket, datetime(2026, 3, 9, tzinfo=dt_timezone.utc))
+        self.assertEqual((week.count, week.low_count, week.medium_count, week.high_count), (3, 1, 1, 1))
+        self.assertAlmostEqual(week.score, 160 / 3)
+
+    def test_orm_fallback_matches_upsert(self):
+        rows = rollups.aggregate(self.session, [(self.when, 80.0)])
+        rollups._upsert_orm(rows)
+        rollups._upsert_orm(rows)
+        minute = self.rollup('student', str(self.user.pk), 'minute')
+        self.assertEqual((minute.count, minute.score_sum, minute.high_count), (2, 160.0, 2))
+
+    def test_rebuild_from_raw_samples(self):
+        start = self.when.timestamp() * 1000
+        ingest_batch(self.session.pk, make_frames(start, 40))
+        AttentionRollup.objects.create(scope='global', key='all', granularity='day', bucket=self.when, count=99)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            random_lstm().save(path)
+            with override_settings(ATTENTION_MODEL_PATH=path, ATTENTION_WINDOW=10):
+                call_command('rebuild_rollups', '--step', '5', stdout=open(os.devnull, 'w'))
+        # 31 full windows, every 5th scored
+        self.assertEqual(self.rollup('global', 'all', 'day').count, 7)
+        self.assertEqual(self.rollup('course', 'math', 'hour').count, 7)
+
+    def test_rebuild_keeps_compacted_history(self):
+        ingest_batch(self.session.pk, make_frames(self.when.timestamp() * 1000, 20))
+        # Rolled up live, from a partition that has since been compacted away
+        compacted = AttentionRollup.objects.create(scope='global', key='all', granularity='day',
+                                                   bucket=self.when - timedelta(days=30), count=50)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            random_lstm().save(path)
+            with override_settings(ATTENTION_MODEL_PATH=path, ATTENTION_WINDOW=10):
+                call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        compacted.refresh_from_db()
+        self.assertEqual(compacted.count, 50)
+        self.assertEqual(self.rollup('course', 'math', 'day').count, 2)
+
+    def test_backfill_refuses_sessions_already_rolled_up(self):
+        ingest_batch(self.session.pk, make_frames(self.when.timestamp() * 1000, 20))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model.npz')
+            random_lstm().save(path)
+            with override_settings(ATTENTION_MODEL_PATH=path, ATTENTION_WINDOW=10):
+                call_command('rebuild_rollups', '--session', str(self.session.pk), stdout=open(os.devnull, 'w'))
+                with self.assertRaises(CommandError):
+                    call_command('rebuild_rollups', '--session', str(self.session.pk), stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.rollup('global', 'all', 'day').count, 2)
+
+    def test_comparison_is_per_classroom(self):
+        other = User.objects.create_user(username='rui', email='rui@example.com', password='x')
+        math_5b = AttentionSession.objects.create(user=self.user, feature_count=3, course='math', classroom='5b')
+        rollups.record_scores(self.session, [(self.when, 90.0)])
+        rollups.record_scores(math_5b, [(self.when, 30.0)])
+        rollups.record_scores(AttentionSession(user=other, classroom='5a'), [(self.when, 50.0)])
+        # Scores of the class on a day the student had none are left out.
+        rollups.record_scores(AttentionSession(user=other, classroom='5a'), [(self.when - timedelta(days=1), 0.0)])
+        report = rollups.student_report(self.user.pk, self.when - timedelta(days=7), ['5a', '5b'])
+        self.assertEqual(report['comparison'], [
+            {'classroom': '5a', 'student': 90.0, 'class': 70.0},
+            {'classroom': '5b', 'student': 30.0, 'class': 30.0},
+        ])
+
+    def test_reports_read_rollups(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        now = rollups.timezone.now()
+        rollups.record_scores(self.session, [(now, 90.0), (now, 60.0)])
+        report = client.get(f'/api/reports/students/{self.user.pk}/').data
+        self.assertEqual(report['timeline'][0]['score'], 75.0)
+        self.assertEqual(sum(h['samples'] for h in report['by_hour']), 2)
+        self.assertEqual(report['comparison'], [{'classroom': '5a', 'student': 75.0, 'class': 75.0}])
+        own = client.get(f'/api/reports/student/{self.user.pk}/series/', {'granularity': 'week'})
+        self.assertEqual(own.data['buckets'][0]['samples'], 2)
+        self.assertEqual(client.get('/api/reports/global/all/series/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(client.get('/api/reports/class/5a/series/').data['buckets'][0]['high'], 1)
+
+
+class AuthTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='gabi', email='gabi@example.com', password='secret-pass-7')
+
+    def test_login_hashes_once(self):
+        client = APIClient()
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.encode', autospec=True,
+                        side_effect=lambda *args: 'pbkdf2_sha256$1$x$y') as encode:
+            response = client.post('/api/auth/login/', {'email': 'gabi@example.com', 'password': 'wrong'}, format='json')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(encode.call_count, 1)
+            encode.reset_mock()
+            response = client.post('/api/auth/login/', {'email': 'nobody@example.com', 'password': 'wrong'}, format='json')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(encode.call_count, 1)
+        response = client.post('/api/auth/login/', {'email': 'gabi@example.com', 'password': 'secret-pass-7'}, format='json')
+        self.assertEqual(response.data['user']['id'], self.user.pk)
+
+    def test_token_is_cached_until_logout(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        client.get('/api/sessions/')
+        with self.assertNumQueries(2):  # ETag keys and the streamed rows
+            response = client.get('/api/sessions/')
+            self.assertEqual(read_json(response), {'results': [], 'next': None})
+        self.assertEqual(client.post('/api/auth/logout/').status_code, 204)
+        self.assertEqual(client.get('/api/sessions/').status_code, 401)
+
+    def test_password_change_evicts_cached_tokens(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        client.get('/api/sessions/')
+        self.assertIsNotNone(token_cache.get(token.key))
+        self.user.set_password('another-pass-8')
+        self.user.save()
+        self.assertIsNone(token_cache.get(token.key))
+
+    def test_cache_is_bounded_and_expires(self):
+        cache = TokenCache(maxsize=2, ttl=60)
+        for key in 'abc':
+            cache.set(key, (self.user, key))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), (self.user, 'c'))
+        with mock.patch('api.authentication.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(cache.get('c'))
+
+
+class ListingTests(TestCase):
+    def setUp(self):
+        Message.objects.bulk_create([Message(text=f'm{i}') for i in range(250)])
+        self.client = APIClient()
+
+    def test_keyset_pages_cover_everything_once(self):
+        seen = []
+        url = '/api/messages/?page_size=100'
+        while url:
+            page = read_json(self.client.get(url))
+            seen.extend(row['text'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(seen, [f'm{i}' for i in reversed(range(250))])
+
+    def test_unchanged_page_is_not_modified(self):
+        first = self.client.get('/api/messages/')
+        etag = first['ETag']
+        self.assertEqual(self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Message.objects.filter(text='m249').update(text='edited')
+        changed = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(read_json(changed)['results'][0]['text'], 'edited')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/messages/?cursor=%%%').status_code, 404)
+
+
+def make_mp4(seconds, payload=b''):
+    mvhd = struct.pack('>B3xIIII', 0, 0, 0, 1000, int(seconds * 1000)) + bytes(80)
+    moov = struct.pack('>I4s', 8 + 8 + len(mvhd), b'moov') + struct.pack('>I4s', 8 + len(mvhd), b'mvhd') + mvhd
+    mdat = struct.pack('>I4s', 8 + len(payload), b'mdat') + payload
+    return struct.pack('>I4s4s', 12, b'ftyp', b'isom') + mdat + moov
+
+
+class CourseMaterialTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media.name)
+        self.override.enable()
+        self.teacher = User.objects.create_user(username='hugo', email='hugo@example.com', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.teacher)
+
+    def tearDown(self):
+        self.override.disable()
+        self.media.cleanup()
+
+    def start_upload(self, data, filename='lecture.mp4'):
+        response = self.client.post('/api/materials/uploads/', {
+            'course': 'math', 'title': 'Lecture 1', 'filename': filename, 'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return f"/api/materials/uploads/{response.data['id']}/"
+
+    def send(self, url, chunk, offset, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = f'sha256 {checksum}'
+        return self.client.generic('PATCH', url, chunk, content_type='application/offset+octet-stream', **headers)
+
+    def test_resumable_upload_and_ranged_download(self):
+        data = make_mp4(90.5, payload=os.urandom(5000))
+        url = self.start_upload(data)
+        first, rest = data[:3000], data[3000:]
+        self.assertEqual(self.send(url, first, 0, hashlib.sha256(first).hexdigest()).data['received'], 3000)
+        self.assertEqual(self.send(url, rest, 10).status_code, 409)
+        bad = self.send(url, rest, 3000, checksum='0' * 64)
+        self.assertEqual((bad.status_code, bad.data['received']), (400, 3000))
+        self.assertEqual(self.client.get(url).data['received'], 3000)
+
+        done = self.send(url, rest, 3000, hashlib.sha256(rest).hexdigest())
+        material = done.data['material']
+        self.assertEqual((material['kind'], material['size'], material['duration']), ('video', len(data), 90.5))
+
+        download = material['download_url']
+        response = APIClient().get(download, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(data)}')
+        self.assertEqual(b''.join(response.streaming_content), data[100:200])
+        full = self.client.get(f"/api/materials/{material['id']}/download/")
+        self.assertEqual(b''.join(full.streaming_content), data)
+        self.assertEqual(APIClient().get(f"/api/materials/{material['id']}/download/?sig=forged").status_code, 401)
+        self.assertEqual(self.client.get(download, HTTP_RANGE=f'bytes={len(data)}-').status_code, 416)
+
+    def test_concurrent_chunks_at_the_same_offset(self):
+        data = os.urandom(4000)
+        url = self.start_upload(data, filename='notes.bin')
+        receive = materials.receive_chunk
+
+        def racing(upload, stream, length, checksum=None):
+            # Another request for the same offset completes while this one reads its body.
+            path = receive(upload, stream, length, checksum)
+            with mock.patch('api.views.receive_chunk', receive):
+                self.assertEqual(self.send(url, data[:1000], 0).data['received'], 1000)
+            return path
+
+        with mock.patch('api.views.receive_chunk', racing):
+            self.assertEqual(self.send(url, data[:1000], 0).status_code, 409)
+        self.assertEqual(self.send(url, data[1000:], 1000).status_code, 200)
+        with open(os.path.join(self.media.name, CourseMaterial.objects.get().file.name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_finalize_runs_after_the_last_chunk_is_committed(self):
+        data = os.urandom(2000)
+        url = self.start_upload(data, filename='notes.bin')
+        self.send(url, data[:1000], 0)
+
+        def finalizing(upload):
+            self.assertEqual(MaterialUpload.objects.get(pk=upload.pk).received, len(data))
+            self.assertEqual(self.send(url, b'', len(data)).data['detail'], 'Upload is being finalized')
+            raise OSError('disk full')
+
+        with mock.patch('api.views.finalize', finalizing), self.assertRaises(OSError):
+            self.send(url, data[1000:], 1000)
+        # The last chunk can be sent again.
+        self.assertEqual(self.client.get(url).data['received'], 1000)
+        self.assertEqual(self.send(url, data[1000:], 1000).status_code, 200)
+        with open(os.path.join(self.media.name, CourseMaterial.objects.get().file.name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_course_cannot_escape_media_root(self):
+        for course in ('../../escape', '/tmp/escape'):
+            response = self.client.post('/api/materials/uploads/', {
+                'course': course, 'title': 'x', 'filename': 'x.pdf', 'size': 10}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_list_etag_changes_before_links_expire(self):
+        etag = self.client.get('/api/materials/')['ETag']
+        self.assertEqual(self.client.get('/api/materials/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        later = time.time() + settings.MATERIAL_LINK_MAX_AGE // 2
+        with mock.patch('api.views.time.time', return_value=later):
+            self.assertEqual(self.client.get('/api/materials/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pdf_page_count(self):
+        path = os.path.join(self.media.name, 'doc.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4 /Type /Pages /Count 3 ' + b' '.join([b'<< /Type /Page >>'] * 3))
+        self.assertEqual(pdf_page_count(path), 3)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=-4', 10), (6, 9))
+        self.assertEqual(parse_range('bytes=5-100', 10), (5, 9))
+        self.assertIsNone(parse_range('bytes=0-1,4-5', 10))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=10-', 10)
+
+
+class WireFormatTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.ts = 1.7e12 + np.arange(50) * 100.0
+        self.features = (0.3 + np.cumsum(rng.normal(scale=0.01, size=(50, 4)), axis=0)).astype(np.float32)
+
+    def test_float32_round_trip_is_a_view(self):
+        batch = wire.decode(wire.encode(self.ts, self.features))
+        np.testing.assert_array_equal(batch.timestamps, self.ts)
+        np.testing.assert_array_equal(batch.features, self.features)
+        self.assertFalse(batch.features.flags.owndata)
+
+    def test_float16_delta_does_not_drift(self):
+        plain = wire.decode(wire.encode(self.ts, self.features, dtype='f2')).features
+        delta = wire.decode(wire.encode(self.ts, self.features, dtype='f2', delta=True)).features
+        np.testing.assert_allclose(plain, self.features, atol=1e-3)
+        np.testing.assert_allclose(delta, self.features, atol=1e-3)
+
+    def test_malformed_payloads(self):
+        payload = wire.encode(self.ts, self.features)
+        for bad in (payload[:10], payload[:-1], b'XXXX' + payload[4:]):
+            with self.assertRaises(ValueError):
+                wire.decode(bad)
+
+    def test_binary_ingestion(self):
+        user = User.objects.create_user(username='ines', email='ines@example.com', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        session_id = client.post('/api/sessions/', {'feature_count': 4}, format='json').data['id']
+        url = f'/api/sessions/{session_id}/samples/'
+        features = self.features.copy()
+        features[3, 0] = np.nan
+        response = client.post(url, wire.encode(self.ts, features), content_type=wire.MEDIA_TYPE)
+        self.assertEqual((response.data['accepted'], response.data['dropped']), (49, 1))
+        chunk, = samplestore.session_chunks(AttentionSession.objects.get(pk=session_id))
+        np.testing.assert_array_equal(chunk_arrays(chunk, 4)[1][3], self.features[4])
+        self.assertEqual(client.post(url, b'junk', content_type=wire.MEDIA_TYPE).status_code, 400)
+        wrong_width = wire.encode(self.ts + 1e6, self.features[:, :3])
+        self.assertEqual(client.post(url, wrong_width, content_type=wire.MEDIA_TYPE).data['dropped'], 50)
+
+
+class BenchMonitoringTests(TestCase):
+    def test_recorder_summary(self):
+        from .management.commands.bench_monitoring import Recorder
+
+        class Target:
+            def request(self, method, path, body=None, headers=None):
+                return (201 if method == 'POST' else 503), b'{"id": 1}', 3
+
+        recorder = Recorder()
+        self.assertEqual(recorder.call(Target(), 'create', 'POST', '/x/'), {'id': 1})
+        self.assertIsNone(recorder.call(Target(), 'poll', 'GET', '/x/'))
+        recorder.call(Target(), 'poll', 'GET', '/x/', expect=(200, 503))
+        summary = recorder.summary(wall=1.0)
+        self.assertEqual(summary['create']['errors'], 0)
+        self.assertEqual((summary['poll']['requests'], summary['poll']['errors']), (2, 1))
+        self.assertEqual(summary['poll']['queries_per_request'], 3)
+
+    def test_server_query_counts(self):
+        from .management.commands.bench_monitoring import Recorder, parse_query_stats
+
+        class Target:
+            def request(self, method, path, body=None, headers=None):
+                return 200, b'', None
+
+        metrics.registry.clear()
+        labels = (resolve('/api/sessions/1/samples/').route, 'api-session-samples', 'POST')
+        metrics.registry.observe('db_queries_per_request', labels, 9, metrics.QUERY_BUCKETS)
+        before = parse_query_stats(metrics.render())
+        recorder = Recorder()
+        for _ in range(2):
+            recorder.call(Target(), 'samples', 'POST', '/api/sessions/1/samples/')
+            metrics.registry.observe('db_queries_per_request', labels, 4, metrics.QUERY_BUCKETS)
+        recorder.add_server_queries(before, parse_query_stats(metrics.render()))
+        metrics.registry.clear()
+        self.assertEqual(recorder.summary(wall=1.0)['samples']['queries_per_request'], 4)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.admin = User.objects.create_user(username='root', email='root@example.com', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_requests_are_recorded_per_route(self):
+        Message.objects.create(text='hi')
+        for _ in range(2):
+            read_json(self.client.get('/api/messages/'))
+        text = self.client.get('/api/metrics/').content.decode()
+        labels = 'route="api/messages/$",view="message-list",method="GET"'
+        self.assertIn(f'http_requests_total{{{labels},status="200"}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', text)
+        # Streamed lists are measured once their body has been sent
+        self.assertRegex(text, r'db_queries_per_request_sum\{%s\} [1-9]' % re.escape(labels))
+        self.assertNotIn('http_response_size_bytes_sum{%s} 0' % labels, text)
+
+    def test_metrics_require_staff(self):
+        user = User.objects.create_user(username='ana', email='ana@example.com', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.get('/api/metrics/').status_code, 403)
+
+    def test_workers_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            labels = ['api/auth/login/', 'api-login', 'POST']
+            other = {'counters': [['http_requests_total', labels + ['200'], 5]],
+                     'histograms': [['db_queries_per_request', labels, [0, 0, 4, 5, 5, 5, 5, 5, 9, 5]]]}
+            with open(os.path.join(directory, '1.json'), 'w') as f:
+                json.dump(other, f)
+            metrics.registry.inc('http_requests_total', tuple(labels + ['200']), 2)
+            text = metrics.render()
+        self.assertIn('http_requests_total{route="api/auth/login/",view="api-login",method="POST",status="200"} 7',
+                      text)
+        self.assertIn('db_queries_per_request_count{route="api/auth/login/",view="api-login",method="POST"} 5', text)
+
+    def test_exited_workers_are_archived(self):
+        labels = ['api/auth/login/', 'api-login', 'POST']
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            for pid, count in ((1001, 5), (1002, 3)):
+                with open(os.path.join(directory, f'{pid}.json'), 'w') as f:
+                    json.dump({'pid': pid, 'counters': [['http_requests_total', labels + ['200'], count]],
+                               'histograms': [], 'gauges': [['worker_rss_bytes', [], 1]]}, f)
+                metrics.archive(pid)
+            self.assertEqual(glob.glob('*.json', root_dir=directory), [metrics.ARCHIVE])
+            counters, _, gauges = metrics.collect()
+            self.assertEqual(counters[('http_requests_total', tuple(labels + ['200']))], 8)
+            self.assertNotIn(('worker_rss_bytes', ()), gauges)
+
+            # Snapshots of processes found gone are archived by the endpoint.
+            with open(os.path.join(directory, '99999999.json'), 'w') as f:
+                json.dump({'pid': 99999999, 'counters': [['http_requests_total', labels + ['200'], 2]],
+                           'histograms': []}, f)
+            counters, _, _ = metrics.collect()
+            self.assertEqual(counters[('http_requests_total', tuple(labels + ['200']))], 10)
+            self.assertFalse(os.path.exists(os.path.join(directory, '99999999.json')))
+
+            metrics.reset()
+            self.assertEqual(glob.glob('*.json', root_dir=directory), [])
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('api.metrics', 'WARNING') as logs:
+            read_json(self.client.get('/api/sessions/'))
+        self.assertIn('Slow request GET /api/sessions/', logs.output[0])
+        self.assertIn('sql', logs.output[0])
+
+
+class SampleStoreTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='gus', email='gus@example.com', password='x')
+        self.session = AttentionSession.objects.create(user=self.user, feature_count=3, course='Física 1')
+        # One minute either side of Monday 2026-03-09 00:00 UTC
+        self.monday = datetime(2026, 3, 9, tzinfo=dt_timezone.utc).timestamp() * 1000
+        ingest_batch(self.session.pk, make_frames(self.monday - 60000, 1200))
+        self.session.refresh_from_db()
+
+    def test_chunks_are_split_by_week(self):
+        tables = list(SamplePartition.objects.order_by('week_start').values_list('table', flat=True))
+        self.assertEqual(len(tables), 2)
+        self.assertTrue(tables[1].startswith('samples_f_sica_1_') and tables[1].endswith('_20260309'))
+        chunks = samplestore.session_chunks(self.session)
+        self.assertTrue(all(c.end_ts < self.monday or c.start_ts >= self.monday for c in chunks))
+        self.assertEqual(sum(c.frame_count for c in chunks), 1200)
+
+        # A range within one week reads the catalog and a single partition.
+        with self.assertNumQueries(2, using='samples'):
+            ts, feats = samplestore.session_arrays(self.session, self.monday, self.monday + 1000)
+        np.testing.assert_array_equal(ts, self.monday + np.arange(11) * 100)
+        self.assertAlmostEqual(float(feats[0, 0]), 60.0, places=3)
+
+    def test_compaction_downsamples_and_drops_expired_partitions(self):
+        call_command('compact_samples', '--raw-days', '0', stdout=open(os.devnull, 'w'))
+        self.assertFalse(SamplePartition.objects.exists())
+        self.assertEqual(samplestore.session_chunks(self.session), [])
+        aggregates = list(SampleAggregate.objects.filter(session_id=self.session.pk))
+        self.assertEqual([a.frame_count for a in aggregates], [600, 600])
+        mean = np.frombuffer(bytes(aggregates[0].mean), dtype='<f4')
+        # Frames 0..599 of the first minute; feature 0 is i / 10
+        self.assertAlmostEqual(float(mean[0]), 29.95, places=3)
+
+    def test_week_buckets_do_not_cross_partitions(self):
+        # Rows of an earlier compaction are added to, not overwritten.
+        SampleAggregate.objects.create(session_id=self.session.pk, start_ts=self.monday, seconds=604800,
+                                       frame_count=600, mean=np.full(3, 3.0, '<f4').tobytes(),
+                                       std=np.zeros(3, '<f4').tobytes())
+        call_command('compact_samples', '--raw-days', '0', '--seconds', '604800', stdout=open(os.devnull, 'w'))
+        aggregates = list(SampleAggregate.objects.filter(session_id=self.session.pk))
+        self.assertEqual([(a.start_ts, a.frame_count) for a in aggregates],
+                         [(self.monday - samplestore.WEEK_MS, 600), (self.monday, 1200)])
+        # Frames 600..1199 have a mean feature of 89.95
+        mean = np.frombuffer(bytes(aggregates[1].mean), dtype='<f4')
+        self.assertAlmostEqual(float(mean[0]), (3.0 + 89.95) / 2, places=3)
+
+    def test_deleting_a_session_deletes_its_samples(self):
+        self.session.delete()
+        for table in SamplePartition.objects.values_list('table', flat=True):
+            self.assertFalse(samplestore.partition_model(table).objects.exists())
+
+
+class ModelStoreTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        inference._engine = inference._registry = None
+
+    def tearDown(self):
+        inference._engine = inference._registry = None
+        self.tmp.cleanup()
+
+    def test_published_weights_are_memory_mapped(self):
+        model = random_lstm()
+        version = modelstore.publish(self.root, model, 'v1')
+        self.assertEqual(modelstore.current_version(self.root), version)
+        loaded = modelstore.load_version(self.root, version)
+        self.assertEqual(modelstore.mapped_bytes(loaded), sum(a.nbytes for a in model.arrays().values()))
+        x = np.random.default_rng(1).normal(size=(2, 5, 3))
+        np.testing.assert_allclose(loaded.forward(x), model.forward(x), rtol=1e-6)
+
+    def test_engine_switches_versions_in_place(self):
+        modelstore.publish(self.root, random_lstm(seed=1), 'v1')
+        with override_settings(ATTENTION_MODEL_DIR=self.root, ATTENTION_MODEL_CHECK_INTERVAL=0, ATTENTION_WINDOW=5):
+            engine = inference.get_engine()
+            self.assertEqual(inference.get_registry().version, 'v1')
+            call_command('publish_model', self._export(random_lstm(seed=2)), '--name', 'v2',
+                         stdout=open(os.devnull, 'w'))
+            self.assertIs(inference.get_engine(), engine)
+            self.assertEqual(inference.get_registry().version, 'v2')
+            self.assertIs(engine.model, inference.get_registry().model)
+
+            call_command('publish_model', '--activate', 'v1', stdout=open(os.devnull, 'w'))
+            inference.get_engine()
+            self.assertEqual(inference.get_registry().version, 'v1')
+            gauges = dict((name, value) for name, labels, value in inference.model_gauges())
+        self.assertGreater(gauges['attention_model_mapped_bytes'], 0)
+        self.assertIn('attention_model_load_seconds', gauges)
+
+    def test_rebuild_uses_the_active_version(self):
+        user = User.objects.create_user(username='ines', email='ines@example.com', password='x')
+        session = AttentionSession.objects.create(user=user, feature_count=3, course='math')
+        ingest_batch(session.pk, make_frames(datetime(2026, 3, 10, 9, tzinfo=dt_timezone.utc).timestamp() * 1000, 20))
+        modelstore.publish(self.root, random_lstm(seed=1), 'v1')
+        with override_settings(ATTENTION_MODEL_DIR=self.root, ATTENTION_MODEL_PATH=None, ATTENTION_WINDOW=10):
+            call_command('rebuild_rollups', stdout=open(os.devnull, 'w'))
+        self.assertEqual(AttentionRollup.objects.get(scope='course', key='math', granularity='day').count, 2)
+
+    def _export(self, model):
+        path = os.path.join(self.root, 'export.npz')
+        model.save(path)
+        return path
+
+
+@override_settings(PROVISIONING_BACKGROUND=False)
+class ProvisioningTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='jose', email='jose@example.com', password='x', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_dry_run_reports_every_row(self):
+        roster = ('email,password,full_name,role\n'
+                  'kim@example.com,pass-kim-1,Kim,student\n'
+                  'jose@example.com,pass-jose-1,Jose,teacher\n'
+                  'KIM@Example.com,pass-kim-2,Kim,student\n'
+                  'not-an-email,x,Nadie,student\n'
+                  'lia@example.com,,Lia,administrador\n')
+        response = self.client.post('/api/users/bulk/?dry_run=1', roster, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        statuses = [(row['email'], row['status']) for row in response.data['report']]
+        self.assertEqual(statuses, [
+            ('kim@example.com', 'would_create'), ('jose@example.com', 'invalid'),
+            ('KIM@example.com', 'would_create'), ('not-an-email', 'invalid'), ('lia@example.com', 'invalid'),
+        ])
+        self.assertEqual(response.data['report'][1]['detail'], 'Only superusers can create staff accounts')
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_job_creates_users_and_tokens(self):
+        self.admin.is_superuser = True
+        self.admin.save()
+        User.objects.create_user(username='luz', email='luz@other.org', password='x')
+        roster = [
+            {'email': 'luz@example.com', 'password': 'pass-luz-1', 'fullName': 'Luz', 'role': 'Docente'},
+            {'email': 'mar@example.com', 'password': 'pass-mar-1'},
+            {'email': 'mar@example.com', 'password': 'pass-mar-2'},
+            {'email': 'noe@example.com'},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/bulk/', roster, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response['Location']).data
+        self.assertEqual(job['status'], ProvisioningJob.STATUS_DONE)
+        self.assertEqual(job['summary'], {'created': 3, 'duplicate': 1})
+
+        luz = User.objects.get(email='luz@example.com')
+        # The local part is taken by another user, so the email is the username.
+        self.assertEqual((luz.username, luz.first_name, luz.is_staff), ('luz@example.com', 'Luz', True))
+        self.assertTrue(luz.check_password('pass-luz-1'))
+        self.assertFalse(User.objects.get(email='noe@example.com').has_usable_password())
+        self.assertEqual(Token.objects.filter(user__email__endswith='@example.com').count(), 3)
+
+        response = APIClient().post('/api/auth/login/', {'email': 'mar@example.com', 'password': 'pass-mar-1'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_roster_must_be_utf8(self):
+        roster = 'email,full_name\nines@example.com,Inés\n'.encode('latin-1')
+        response = self.client.post('/api/users/bulk/', roster, content_type='text/csv')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Rosters must be encoded in UTF-8'))
+        upload = SimpleUploadedFile('roster.csv', roster, content_type='text/csv')
+        response = self.client.post('/api/users/bulk/', {'roster': upload}, format='multipart')
+        self.assertEqual((response.status_code, response.data['detail']), (400, 'Rosters must be encoded in UTF-8'))
+
+    def test_command_hashes_in_a_process_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'roster.csv')
+            with open(path, 'w') as f:
+                f.write('email,password\n')
+                f.writelines(f'user{i}@example.com,pass-{i}\n' for i in range(provisioning.MIN_POOL_PASSWORDS))
+            report_path = os.path.join(directory, 'report.json')
+            call_command('provision_users', path, '--workers', '2', '--report', report_path,
+                         stdout=open(os.devnull, 'w'))
+            with open(report_path) as f:
+                report = json.load(f)
+        self.assertEqual({row['status'] for row in report}, {'created'})
+        self.assertTrue(User.objects.get(email='user3@example.com').check_password('pass-3'))
+
+
+def attention_result(score):
+    return {'score': score, 'level': inference.attention_level(score),
+            'label': inference.LABEL_ATTENTION if score >= 50 else inference.LABEL_DISTRACTION}
+
+
+class AnalyticsTests(TestCase):
+    databases = {'default', 'samples'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='olga', email='olga@example.com', password='x')
+        self.session = AttentionSession.objects.create(user=self.user, feature_count=3, classroom='5a')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_tracker_statistics_by_phase(self):
+        tracker = analytics.SessionTracker(ewma_seconds=10, max_gap=5, min_episode=3, alert_seconds=6)
+        # One score per second: 4 s attentive, 8 s distracted, a 30 s gap, then a break
+        scores = [(t, 80.0, 'trabajo') for t in range(4)] + [(t, 20.0, 'trabajo') for t in range(4, 12)]
+        scores += [(42, 90.0, 'descanso-corto'), (43, 10.0, None), (44, 10.0, None)]
+        events = []
+        for t, score, phase in scores:
+            result = attention_result(score)
+            events += tracker.observe(t * 1000.0, score, result['level'], result['label'] == 'distraction', phase)
+        tracker.finish()
+        summary = tracker.summary()
+
+        self.assertEqual(events, [{'type': 'distraction_episode', 'since': 4000.0, 'seconds': 6.0}])
+        values = [score for _, score, _ in scores]
+        self.assertEqual(summary['samples'], len(values))
+        self.assertAlmostEqual(summary['mean'], np.mean(values), places=2)
+        self.assertAlmostEqual(summary['std'], np.std(values), places=2)
+        work, rest = summary['phases']['trabajo'], summary['phases']['descanso-corto']
+        # The gap is not counted, and ends the episode at the last score before it
+        self.assertEqual(work['seconds'], {'low': 7.0, 'medium': 0.0, 'high': 4.0})
+        self.assertEqual((work['episodes'], work['longest_episode']), (1, 7.0))
+        self.assertEqual(rest['seconds'], {'low': 1.0, 'medium': 0.0, 'high': 1.0})
+        self.assertEqual(rest['episodes'], 0)
+        self.assertEqual(summary['recent_episodes'],
+                         [{'start': 4000.0, 'end': 11000.0, 'seconds': 7.0, 'phase': 'trabajo'}])
+        self.assertLess(rest['ewma'], 90.0)
+
+        merged = analytics.RunningStats.from_dict(work).merge(analytics.RunningStats.from_dict(rest)).as_dict()
+        self.assertAlmostEqual(merged['mean'], summary['mean'], places=1)
+        self.assertAlmostEqual(merged['std'], summary['std'], places=1)
+
+    def test_close_stores_summary_for_alerts_and_reports(self):
+        response = self.client.post(f'/api/sessions/{self.session.pk}/samples/',
+                                    {'frames': make_frames(0, 5), 'phase': 'almuerzo'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/api/sessions/{self.session.pk}/summary/').status_code, 404)
+
+        start = 1e12
+        for i, score in enumerate([85.0, 30.0, 30.0, 30.0, 30.0, 75.0]):
+            analytics.observe(self.session, attention_result(score), start + i * 1000, 'trabajo')
+        live = self.client.get(f'/api/sessions/{self.session.pk}/summary/').data
+        self.assertEqual((live['samples'], live['phase'], live['distraction_episodes']), (6, 'trabajo', 1))
+
+        broker = mock.Mock()
+        with mock.patch.object(realtime, 'get_broker', return_value=broker):
+            self.client.post(f'/api/sessions/{self.session.pk}/close/')
+        message = broker.publish.call_args.args[1]
+        self.assertEqual((message['type'], message['distraction_episodes'], message['distracted_seconds']),
+                         ('session_summary', 1, 4.0))
+        self.assertEqual(SessionSummary.objects.get(session=self.session).seconds, 5.0)
+        stored = self.client.get(f'/api/sessions/{self.session.pk}/summary/').data
+        self.assertEqual(stored['phases']['trabajo']['seconds'], {'low': 4.0, 'medium': 0.0, 'high': 1.0})
+
+        report = self.client.get(f'/api/reports/students/{self.user.pk}/').data
+        self.assertEqual([(p['phase'], p['samples'], p['episodes']) for p in report['pomodoro']], [('trabajo', 6, 1)])
+
+    def test_session_scored_by_two_workers(self):
+        # One score per second for 60 s, distracted from 20 s to 40 s. Workers
+        # keep no tracker in memory: each score continues the stored one,
+        # whichever worker handles the batch.
+        start = 1e12
+        scores = [(start + t * 1000, 20.0 if 20 <= t < 40 else 80.0) for t in range(61)]
+        for ts, score in scores:
+            analytics.observe(self.session, attention_result(score), ts, 'trabajo')
+        with mock.patch.object(realtime, 'get_broker', return_value=mock.Mock()):
+            self.client.post(f'/api/sessions/{self.session.pk}/close/')
+        stored = self.client.get(f'/api/sessions/{self.session.pk}/summary/').data
+        self.assertTrue(stored['final'])
+        self.assertEqual((stored['samples'], stored['seconds']), (61, 60.0))
+        self.assertEqual((stored['distraction_episodes'], stored['distracted_seconds']), (1, 20.0))
@@ -1,11 +1,22 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
-from .views import MessageViewSet, LoginView, RegisterView
+from .views import (
+	MessageViewSet, AttentionSessionViewSet, CourseMaterialViewSet, MaterialUploadViewSet, LoginView, LogoutView, MetricsView,
+	ProvisioningJobViewSet, RegisterView, RollupSeriesView, StudentReportView,
+)
 
 router = DefaultRouter()
 router.register(r'messages', MessageViewSet, basename='message')
+router.register(r'sessions', AttentionSessionViewSet, basename='session')
+router.register(r'materials/uploads', MaterialUploadViewSet, basename='material-upload')
+router.register(r'materials', CourseMaterialViewSet, basename='material')
+router.register(r'users/bulk', ProvisioningJobViewSet, basename='provisioning-job')
 
 urlpatterns = router.urls + [
 	path('auth/login/', LoginView.as_view(), name='api-login'),
+	path('auth/logout/', LogoutView.as_view(), name='api-logout'),
 	path('auth/register/', RegisterView.as_view(), name='api-register'),
+	path('metrics/', MetricsView.as_view(), name='api-metrics'),
+	path('reports/students/<int:user_id>/', StudentReportView.as_view(), name='api-student-report'),
+	path('reports/<str:scope>/<str:key>/series/', RollupSeriesView.as_view(), name='api-rollup-series'),
 ]
@@ -1,17 +1,312 @@
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.authtoken.models import Token
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
-from .models import Message
-from .serializers import MessageSerializer
+from django.core import signing
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from . import analytics, metrics
+from .inference import get_engine
+from .listing import KeysetListMixin
+from .materials import (
+    UploadError, append_chunk, check_chunk, finalize, material_response, part_path, receive_chunk,
+)
+from .ingestion import SessionClosed
+from .models import (
+    Message, AttentionSession, AttentionRollup, CourseMaterial, MaterialUpload, ProvisioningJob, SessionSummary,
+)
+from .provisioning import RosterError, RosterParser, provision, read_roster, start_job, summarize
+from .realtime import handle_batch, latest_attention, publish_summary
+from .rollups import GRANULARITIES, GLOBAL_KEY, series, student_report
+from .serializers import (
+    MessageSerializer, AttentionSessionSerializer, CourseMaterialSerializer, MaterialUploadSerializer,
+    ProvisioningJobSerializer, SessionSummarySerializer,
+)
+from .wire import FrameBatch, FrameBatchParser
 
 User = get_user_model()
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(KeysetListMixin, viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    etag_fields = ('text',)
+
+
+class AttentionSessionViewSet(KeysetListMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                              viewsets.GenericViewSet):
+    """Monitoring sessions of the current user and their batched frame ingestion."""
+    serializer_class = AttentionSessionSerializer
+    permission_classes = [IsAuthenticated]
+    etag_fields = ('ended_at', 'frame_count')
+
+    def get_queryset(self):
+        return AttentionSession.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=['post'], parser_classes=[JSONParser, FrameBatchParser])
+    def samples(self, request, pk=None):
+        session = self.get_object()
+        binary = isinstance(request.data, FrameBatch)
+        if not binary and not isinstance(request.data, dict):
+            return Response({'detail': 'Expected a JSON object with frames'}, status=status.HTTP_400_BAD_REQUEST)
+        frames = request.data if binary else request.data.get('frames')
+        if not isinstance(frames, (list, FrameBatch)):
+            return Response({'detail': 'frames must be a list'}, status=status.HTTP_400_BAD_REQUEST)
+        # The current Pomodoro phase, in the JSON body or, for binary batches, the query string
+        phase = request.query_params.get('phase') if binary else request.data.get('phase')
+        if phase is not None and phase not in analytics.PHASES:
+            return Response({'detail': 'Unknown Pomodoro phase'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = handle_batch(session, frames, phase=phase)
+        except SessionClosed:
+            return Response({'detail': 'Session already closed'}, status=status.HTTP_409_CONFLICT)
+        return Response(result, status=status.HTTP_201_CREATED if result['accepted'] else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def attention(self, request, pk=None):
+        session = self.get_object()
+        engine = get_engine()
+        if engine is None:
+            return Response({'detail': 'Attention model not configured'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'attention': latest_attention(session)})
+
+    @action(detail=True, methods=['post'])
+    def close(self, request, pk=None):
+        session = self.get_object()
+        if session.is_open:
+            session.ended_at = timezone.now()
+            session.save(update_fields=['ended_at'])
+        engine = get_engine()
+        if engine is not None:
+            engine.close_session(session.pk)
+        publish_summary(session, analytics.close_session(session))
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        """Summary of a session with its current phase and EWMA score.
+
+        ``final`` is false while the session is open and the summary partial.
+        """
+        session = self.get_object()
+        summary = SessionSummary.objects.filter(session=session).first()
+        if summary is None:
+            return Response({'detail': 'No scores for this session yet'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({**SessionSummarySerializer(summary).data, **analytics.live_fields(summary),
+                         'final': not session.is_open})
+
+
+class CourseMaterialViewSet(KeysetListMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Course materials, filterable with ``?course=``, and their download."""
+    queryset = CourseMaterial.objects.all()
+    serializer_class = CourseMaterialSerializer
+    permission_classes = [IsAuthenticated]
+    etag_fields = ('sha256', 'title')
+
+    def etag_extra(self):
+        # Every page embeds signed download links. The ETag changes every half
+        # link lifetime, so a revalidated page never holds an expired link.
+        return (int(time.time() // max(settings.MATERIAL_LINK_MAX_AGE // 2, 1)),)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        course = self.request.query_params.get('course')
+        return queryset.filter(course=course) if course else queryset
+
+    def get_permissions(self):
+        if self.action == 'download':
+            return []
+        return super().get_permissions()
+
+    @action(detail=True, methods=['get'], url_name='download')
+    def download(self, request, pk=None):
+        if not request.user.is_authenticated:
+            try:
+                signer = signing.TimestampSigner(salt='material-download')
+                valid = signer.unsign(request.query_params.get('sig', ''), max_age=settings.MATERIAL_LINK_MAX_AGE) == str(pk)
+            except signing.BadSignature:
+                valid = False
+            if not valid:
+                raise NotAuthenticated()
+        return material_response(request, self.get_object())
+
+
+class MaterialUploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Resumable uploads of course materials (staff only), see ``api.materials``.
+
+    ``GET`` returns the current ``received`` offset to resume from and
+    ``PATCH`` appends the raw request body at ``Upload-Offset``.
+    """
+    serializer_class = MaterialUploadSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return MaterialUpload.objects.filter(owner=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(owner=self.request.user)
+
+    def partial_update(self, request, pk=None):
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers.get('Content-Length') or 0)
+        except (KeyError, ValueError):
+            return Response({'detail': 'Upload-Offset and Content-Length required'}, status=status.HTTP_400_BAD_REQUEST)
+        algorithm, _, checksum = request.headers.get('Upload-Checksum', '').partition(' ')
+        if checksum and algorithm.lower() != 'sha256':
+            return Response({'detail': 'Only sha256 checksums are supported'}, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = self.get_object()
+        if upload.complete:
+            return Response({'detail': 'Upload already complete'}, status=status.HTTP_409_CONFLICT)
+        try:
+            # Checked again under the lock; failing here skips reading the body.
+            check_chunk(upload, offset, length)
+            chunk = receive_chunk(upload, request.stream, length, checksum or None)
+        except UploadError as exc:
+            return Response({'detail': exc.detail, 'received': upload.received}, status=exc.status,
+                            headers={'Upload-Offset': str(upload.received)})
+
+        try:
+            with transaction.atomic():
+                # Write before reading so two requests cannot both pass the offset
+                # check: select_for_update() does not lock anything on SQLite.
+                MaterialUpload.objects.filter(pk=upload.pk).update(received=F('received'))
+                upload = self.get_queryset().get(pk=upload.pk)
+                if upload.complete:
+                    return Response({'detail': 'Upload already complete'}, status=status.HTTP_409_CONFLICT)
+                if upload.received == upload.size:
+                    return Response({'detail': 'Upload is being finalized'}, status=status.HTTP_409_CONFLICT)
+                try:
+                    upload.received = append_chunk(upload, chunk, offset, length)
+                except UploadError as exc:
+                    return Response({'detail': exc.detail, 'received': upload.received}, status=exc.status,
+                                    headers={'Upload-Offset': str(upload.received)})
+                upload.save(update_fields=['received', 'updated_at'])
+        finally:
+            os.remove(chunk)
+
+        if upload.received == upload.size:
+            # Hashing, indexing and moving the file can take long: it runs
+            # after the commit, while the full offset keeps other chunks out.
+            try:
+                upload.material = finalize(upload)
+            except BaseException as exc:
+                # Resending the last chunk retries, as long as the .part file is left.
+                upload.received = offset if os.path.exists(part_path(upload)) else 0
+                MaterialUpload.objects.filter(pk=upload.pk).update(received=upload.received)
+                if not isinstance(exc, UploadError):
+                    raise
+                return Response({'detail': exc.detail, 'received': upload.received}, status=exc.status,
+                                headers={'Upload-Offset': str(upload.received)})
+            upload.save(update_fields=['material', 'updated_at'])
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.received)})
+
+
+def _report_since(request, default_days=30):
+    try:
+        days = min(max(int(request.query_params.get('days', default_days)), 1), 366)
+    except ValueError:
+        days = default_days
+    return timezone.now() - timedelta(days=days)
+
+
+class ProvisioningJobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Bulk creation of users from a roster (staff only), see ``api.provisioning``.
+
+    ``POST`` takes a JSON list of users, a ``text/csv`` body or a ``roster``
+    file. With ``?dry_run=1`` the per-row report is returned at once;
+    otherwise the roster is provisioned in the background and the job is
+    polled with ``GET``. Only superusers may create teachers and
+    administrators, which are staff accounts.
+    """
+    serializer_class = ProvisioningJobSerializer
+    permission_classes = [IsAdminUser]
+    parser_classes = [JSONParser, RosterParser, MultiPartParser]
+
+    def get_queryset(self):
+        return ProvisioningJob.objects.filter(created_by=self.request.user)
+
+    def create(self, request):
+        data, format = request.data, None
+        roster = request.FILES.get('roster')
+        if roster is not None:
+            data, format = roster.read(), 'json' if roster.name.lower().endswith('.json') else 'csv'
+        try:
+            rows = read_roster(data, format)
+        except RosterError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        allow_admins = request.user.is_superuser
+
+        if request.query_params.get('dry_run') in ('1', 'true'):
+            report = provision(rows, dry_run=True, allow_admins=allow_admins)
+            return Response({'dry_run': True, 'summary': summarize(report), 'report': report})
+
+        job = ProvisioningJob.objects.create(created_by=request.user, total=len(rows))
+        transaction.on_commit(lambda: start_job(job, rows, allow_admins))
+        headers = {'Location': reverse('provisioning-job-detail', args=[job.pk], request=request)}
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED, headers=headers)
+
+
+class RollupSeriesView(APIView):
+    """Attention rollup buckets of a student, course, class or the platform.
+
+    Students may only read their own series; other scopes require staff.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, scope, key):
+        if scope not in dict(AttentionRollup.SCOPE_CHOICES):
+            return Response({'detail': 'Unknown scope'}, status=status.HTTP_404_NOT_FOUND)
+        own = scope == AttentionRollup.SCOPE_STUDENT and key == str(request.user.pk)
+        if not (own or request.user.is_staff):
+            return Response({'detail': 'Not allowed'}, status=status.HTTP_403_FORBIDDEN)
+        if scope == AttentionRollup.SCOPE_GLOBAL:
+            key = GLOBAL_KEY
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return Response({'detail': 'Unknown granularity'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'scope': scope, 'key': key, 'granularity': granularity,
+                         'buckets': series(scope, key, granularity, _report_since(request))})
+
+
+class StudentReportView(APIView):
+    """Data behind the StudentReport page, read from the rollups and session summaries only."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, user_id):
+        if user_id != request.user.pk and not request.user.is_staff:
+            return Response({'detail': 'Not allowed'}, status=status.HTTP_403_FORBIDDEN)
+        since = _report_since(request)
+        classrooms = (AttentionSession.objects.filter(user_id=user_id, started_at__gte=since)
+                      .exclude(classroom='').values_list('classroom', flat=True).distinct())
+        report = student_report(user_id, since, sorted(classrooms))
+        report['pomodoro'] = analytics.phase_report(
+            SessionSummary.objects.filter(session__user_id=user_id, session__started_at__gte=since))
+        return Response(report)
+
+
+class MetricsView(APIView):
+    """Request metrics of all workers in the Prometheus text format (see api.metrics)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 class LoginView(APIView):
@@ -24,16 +319,8 @@ class LoginView(APIView):
         if not email or not password:
             return Response({'detail': 'Email and password required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Try to authenticate — assumes User.email is used for login or username fallback
-        user = authenticate(request, username=email, password=password)
-        if user is None:
-            # Try authenticating by username if email auth not configured
-            try:
-                user_obj = User.objects.filter(email=email).first()
-                if user_obj:
-                    user = authenticate(request, username=user_obj.username, password=password)
-            except Exception:
-                user = None
+        # Resolved by api.backends.EmailBackend: one lookup, one password hash
+        user = authenticate(request, email=email, password=password)
 
         if user is None:
             return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
@@ -42,6 +329,16 @@ class LoginView(APIView):
         return Response({'token': token.key, 'user': {'id': user.id, 'username': getattr(user, 'username', ''), 'email': getattr(user, 'email', '')}})
 
 
+class LogoutView(APIView):
+    """Revoke the token used for the request."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if isinstance(request.auth, Token):
+            request.auth.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class RegisterView(APIView):
     """Simple registration view that creates a user with email and password."""
     permission_classes = []
@@ -60,11 +357,7 @@ class RegisterView(APIView):
 
         # Create user — if your User model requires username, use email as username
         username = email.split('@')[0]
-        user = User.objects.create_user(username=username, email=email, password=password)
-        # Optionally save full name or custom fields if present
-        if hasattr(user, 'first_name') and full_name:
-            user.first_name = full_name
-            user.save()
+        user = User.objects.create_user(username=username, email=email, password=password, first_name=full_name)
 
         token, created = Token.objects.get_or_create(user=user)
         return Response({'token': token.key, 'user': {'id': user.id, 'username': user.username, 'email': user.email}}, status=status.HTTP_201_CREATED)
@@ -0,0 +1,118 @@
+"""Binary wire format for feature-frame batches.
+
+Sent with ``Content-Type: application/x-attention-frames`` to the sample
+ingestion endpoint (or as a binary message on the student socket). JSON
+stays available under ``application/json``. All values are little-endian::
+
+    offset  size  field
+    0       4     magic          b'ATF1'
+    4       1     version        1
+    5       1     dtype          1 = float16, 2 = float32
+    6       1     flags          bit 0: features are delta-encoded
+    7       1     reserved
+    8       2     feature_count  F
+    10      2     reserved
+    12      4     frame_count    N
+    16      4     reserved
+    20      8     t0             float64, ms since the epoch of frame 0
+    28      4     reserved
+    32      4*N   offsets        uint32, ms of each frame after t0
+    32+4N   N*F   features       dtype, row-major (frame by frame)
+
+With the delta flag, row ``i`` of the features holds ``frame[i] -
+frame[i - 1]`` (row 0 is absolute). Small steps of slowly varying signals
+keep more float16 precision than their absolute values; the encoder works
+against the reconstructed values so rounding does not accumulate.
+``manage.py bench_wire`` compares the sizes and parse times with JSON.
+
+Decoding does not create a Python object per value: offsets and float32
+features are ``numpy.frombuffer`` views over the request body. Only the
+float64 timestamps and float16 or delta-encoded features are materialized,
+each as a single array operation.
+"""
+import struct
+
+import numpy as np
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+MEDIA_TYPE = 'application/x-attention-frames'
+MAGIC = b'ATF1'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxHxxIxxxxdxxxx')
+DTYPES = {1: np.dtype('<f2'), 2: np.dtype('<f4')}
+DTYPE_CODES = {'f2': 1, 'float16': 1, 'f4': 2, 'float32': 2}
+FLAG_DELTA = 1
+
+
+class FrameBatch:
+    """Decoded frames: ``timestamps`` (N,) float64 ms and ``features`` (N, F)."""
+
+    def __init__(self, timestamps, features):
+        self.timestamps = timestamps
+        self.features = features
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def feature_count(self):
+        return self.features.shape[1]
+
+
+def encode(timestamps, features, dtype='f4', delta=False):
+    """Encode frames; ``timestamps`` are ms since the epoch."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    features = np.asarray(features, dtype=np.float32).reshape(len(timestamps), -1)
+    code = DTYPE_CODES[dtype]
+    wire_dtype = DTYPES[code]
+    t0 = float(timestamps[0]) if len(timestamps) else 0.0
+    offsets = np.rint(timestamps - t0).astype('<u4')
+    if delta and len(features):
+        rows = np.empty(features.shape, dtype=wire_dtype)
+        recon = np.zeros(features.shape[1], dtype=np.float32)
+        for i, row in enumerate(features):
+            rows[i] = row - recon
+            recon += rows[i].astype(np.float32)
+        payload = rows
+    else:
+        payload = features.astype(wire_dtype)
+    header = HEADER.pack(MAGIC, VERSION, code, FLAG_DELTA if delta else 0, features.shape[1], len(timestamps), t0)
+    return header + offsets.tobytes() + payload.tobytes()
+
+
+def decode(data):
+    """Decode a payload produced by ``encode``; raises ``ValueError`` if malformed."""
+    data = memoryview(data)
+    if len(data) < HEADER.size:
+        raise ValueError('Payload shorter than the header')
+    magic, version, code, flags, feature_count, frame_count, t0 = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not an attention frame batch')
+    if code not in DTYPES or not feature_count:
+        raise ValueError('Unsupported dtype or feature count')
+    dtype = DTYPES[code]
+    start = HEADER.size + 4 * frame_count
+    end = start + frame_count * feature_count * dtype.itemsize
+    if len(data) != end:
+        raise ValueError('Payload size does not match its header')
+
+    offsets = np.frombuffer(data, dtype='<u4', count=frame_count, offset=HEADER.size)
+    features = np.frombuffer(data, dtype=dtype, count=frame_count * feature_count, offset=start)
+    features = features.reshape(frame_count, feature_count)
+    if flags & FLAG_DELTA:
+        features = np.cumsum(features, axis=0, dtype=np.float32)
+    elif dtype != np.float32:
+        features = features.astype(np.float32)
+    return FrameBatch(offsets + t0, features)
+
+
+class FrameBatchParser(BaseParser):
+    """DRF parser turning a binary payload into a ``FrameBatch``."""
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode(stream.read() if stream is not None else b'')
+        except ValueError as exc:
+            raise ParseError(f'Malformed frame batch: {exc}')
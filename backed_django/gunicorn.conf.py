@@ -0,0 +1,22 @@
+# Read by gunicorn when started from this directory: `gunicorn`.
+wsgi_app = 'monitoring.wsgi:application'
+
+# Import the app, and map the attention model weights, once in the master
+# before forking, so workers start warm and share the weight pages.
+preload_app = True
+
+
+# Worker metrics are summed from snapshot files in METRICS_DIR (api.metrics).
+def on_starting(server):
+    from api import metrics
+    metrics.reset()
+
+
+def worker_exit(server, worker):
+    from api import metrics
+    metrics.registry.flush(force=True)
+
+
+def child_exit(server, worker):
+    from api import metrics
+    metrics.archive(worker.pid)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -98,13 +100,108 @@ except Exception:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
-        }
+        },
+        # Attention samples (api.routers), in WAL mode (api.signals)
+        'samples': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'samples.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'CONN_HEALTH_CHECKS': True,
+        },
     }
 
+# Sample chunks live in SAMPLES_DATABASE, one table per course and week.
+# compact_samples downsamples partitions older than SAMPLE_RAW_RETENTION_DAYS
+# into SAMPLE_AGGREGATE_SECONDS buckets, then drops them; aggregates older
+# than SAMPLE_AGGREGATE_RETENTION_DAYS are deleted (None keeps them).
+DATABASE_ROUTERS = ['api.routers.SampleRouter']
+SAMPLES_DATABASE = 'samples'
+SAMPLE_RAW_RETENTION_DAYS = 28
+SAMPLE_AGGREGATE_SECONDS = 60
+SAMPLE_AGGREGATE_RETENTION_DAYS = 365
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
 ]
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.CachedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+}
+
+# Default page size of the keyset-paginated list endpoints (api.listing)
+API_LIST_PAGE_SIZE = 100
+
+# Resolved API tokens are cached per process; logout and password changes
+# evict them locally, other workers notice within TOKEN_CACHE_TTL seconds.
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 30
+
+# Attention sample ingestion
+# Frames beyond ATTENTION_MAX_BATCH_FRAMES in one request are dropped, and
+# accepted frames are packed ATTENTION_CHUNK_FRAMES per database row.
+ATTENTION_MAX_BATCH_FRAMES = 2000
+ATTENTION_CHUNK_FRAMES = 256
+
+# Attention inference
+# Weights exported to .npz run on the NumPy LSTM; a Keras model file needs
+# TensorFlow. Windows of concurrent sessions are batched together, up to
+# ATTENTION_MAX_BATCH_SIZE windows or ATTENTION_MAX_WAIT_MS of waiting.
+ATTENTION_MODEL_PATH = BASE_DIR / 'models' / 'attention_lstm.npz'
+# Versions published with `manage.py publish_model` (api.modelstore) take
+# precedence over ATTENTION_MODEL_PATH. Their weights are memory-mapped and
+# shared by all workers; workers switch to a newly activated version within
+# ATTENTION_MODEL_CHECK_INTERVAL seconds.
+ATTENTION_MODEL_DIR = BASE_DIR / 'models' / 'attention'
+ATTENTION_MODEL_CHECK_INTERVAL = 5
+ATTENTION_WINDOW = 30
+ATTENTION_MAX_BATCH_SIZE = 64
+ATTENTION_MAX_WAIT_MS = 10
+ATTENTION_DISTRACTION_THRESHOLD = 0.5
+
+# Pub/sub backend fanning scores out to the /ws/classes/<classroom>/ sockets.
+# The in-process broker only reaches sockets served by the same process.
+ATTENTION_BROKER = 'api.realtime.InProcessBroker'
+
+# Streaming session analytics (api.analytics), split by Pomodoro phase.
+# Scores are smoothed by an EWMA with a time constant of
+# ANALYTICS_EWMA_SECONDS. Gaps longer than ANALYTICS_MAX_GAP_SECONDS
+# (camera off) are not counted. Distraction episodes shorter than
+# ANALYTICS_MIN_EPISODE_SECONDS are ignored. An episode reaching
+# ANALYTICS_ALERT_SECONDS in a work phase alerts the class feed.
+ANALYTICS_EWMA_SECONDS = 30
+ANALYTICS_MAX_GAP_SECONDS = 10
+ANALYTICS_MIN_EPISODE_SECONDS = 3
+ANALYTICS_ALERT_SECONDS = 30
+
+
+# Request metrics served at /api/metrics/ (api.metrics). Every process writes
+# its metrics to METRICS_DIR, where they are summed; gunicorn.conf.py empties
+# it at startup. None keeps the metrics of each process to itself, as in
+# tests. Requests slower than METRICS_SLOW_REQUEST_MS are logged with their
+# SQL and a sampled profile; None disables the slow-request log and its
+# overhead.
+METRICS_DIR = None if sys.argv[1:2] == ['test'] else BASE_DIR / 'metrics'
+METRICS_FLUSH_INTERVAL = 1
+METRICS_SLOW_REQUEST_MS = None
+METRICS_PROFILE_INTERVAL_MS = 5
+
+
+AUTHENTICATION_BACKENDS = [
+    'api.backends.EmailBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Bulk user provisioning (api.provisioning, POST /api/users/bulk/ and
+# `manage.py provision_users`). Passwords are hashed by
+# PROVISIONING_HASH_WORKERS processes, one per CPU when None. Rosters posted
+# to the API are provisioned in a background thread of the web process.
+PROVISIONING_HASH_WORKERS = None
+PROVISIONING_MAX_ROWS = 20000
+PROVISIONING_BACKGROUND = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -142,6 +239,17 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (course materials)
+
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Materials are uploaded in chunks of at most MATERIAL_MAX_CHUNK_SIZE bytes;
+# signed download links stay valid for MATERIAL_LINK_MAX_AGE seconds.
+MATERIAL_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+MATERIAL_MAX_UPLOAD_SIZE = 4 * 1024 * 1024 * 1024
+MATERIAL_LINK_MAX_AGE = 6 * 60 * 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'monitoring.settings')
 
 application = get_wsgi_application()
+
+# Load the attention model now: before the fork when gunicorn preloads the
+# app (see gunicorn.conf.py), and in any case before the first request.
+from api.inference import preload  # noqa: E402
+
+preload()
@@ -18,7 +18,7 @@ export default function Home() {
   useEffect(() => {
     axios.get('http://localhost:8000/api/messages/')
       .then(response => {
-        setMessages(response.data);
+        setMessages(response.data.results);
       })
       .catch(error => {
         console.error('There was an error fetching the messages!', error);